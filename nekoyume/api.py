@@ -1,14 +1,113 @@
 import datetime
-
-from flask import Blueprint, jsonify, request
+import gzip
+from hashlib import sha256
+import math
+import typing
+import zlib
+
+from bencode import BencodeDecodeError, bdecode, bencode
+from flask import (Blueprint, Response, json, jsonify, request,
+                   stream_with_context)
 import requests
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 
-from nekoyume.tasks import block_broadcast, move_broadcast
-from nekoyume.models import db, Block, Node, Move, get_my_public_url
+from nekoyume.exc import InvalidBlockError, InvalidMoveError
+from nekoyume.tasks import relay_queue
+from nekoyume.models import (BENCODE_MIMETYPE, BLOCKS_LIMIT, db, Block,
+                             Node, Move, get_my_public_url, get_tip,
+                             serialized_move_id, serializations, update_tip,
+                             verify_moves, wait_for_tip)
 
 
 api = Blueprint('api', __name__, template_folder='templates')
+#: The number of blocks :func:`get_blocks()` loads at once.
+BLOCKS_BATCH_SIZE = 50
+#: The maximum number of headers :func:`get_block_headers()` responds with.
+HEADERS_LIMIT = 10000
+#: The maximum number of hashes :func:`post_block_locator()` accepts.
+LOCATOR_LIMIT = 500
+#: The maximum number of seconds :func:`wait_block()` waits for.
+WAIT_TIMEOUT_LIMIT = 30
+#: The number of blocks after which blocks are cached for a long time.
+STABLE_DEPTH = 100
+#: The maximum number of blocks :func:`post_blocks_batch()` accepts.
+POST_BLOCKS_LIMIT = 100
+#: The maximum number of moves :func:`post_moves_batch()` accepts.
+POST_MOVES_LIMIT = 500
+
+
+def accepts_bencode() -> bool:
+    """Whether the client prefers :const:`BENCODE_MIMETYPE` to JSON."""
+    return request.accept_mimetypes.best_match(
+        ['application/json', BENCODE_MIMETYPE]
+    ) == BENCODE_MIMETYPE
+
+
+def get_bencoded_body(key: str):
+    """Get the object of the given key and ``sent_node`` from a request
+    body in :const:`BENCODE_MIMETYPE`.
+    """
+    try:
+        body = bdecode(request.get_data())
+        return body[key], body.get('sent_node')
+    except (BencodeDecodeError, KeyError, TypeError):
+        return None, None
+
+
+def cacheable(hashes: typing.List[str], depth: int, mimetype: str,
+              render: typing.Callable[[], Response]) -> Response:
+    """
+    Make a response of blocks compressed and cacheable.  Its strong ETag
+    is made of the hashes of the blocks and the representation, so a
+    client which already has the response gets 304 Not Modified without
+    the blocks being loaded.  Blocks deep enough are cached for a day, as
+    they change only on a reorg; others have to be revalidated.
+
+    :param hashes: hashes of the blocks in the response, in order.
+    :param  depth: number of blocks following the last block in the
+                   response.
+    :param mimetype: media type of the response.
+    :param render: a function which makes the response.
+    """
+    gzipped = request.accept_encodings['gzip'] > 0
+    etag = sha256('\n'.join(
+        [mimetype, 'gzip' if gzipped else 'identity'] + hashes
+    ).encode('utf-8')).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = render()
+        if gzipped:
+            if response.is_streamed:
+                response.response = gzip_stream(response.iter_encoded())
+            else:
+                response.set_data(gzip.compress(response.get_data()))
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    response.cache_control.public = True
+    if depth >= STABLE_DEPTH:
+        response.cache_control.max_age = 60 * 60 * 24
+    else:
+        response.cache_control.no_cache = True
+    response.vary.update(['Accept', 'Accept-Encoding'])
+    return response
+
+
+def gzip_stream(chunks: typing.Iterable[bytes]) -> typing.Iterator[bytes]:
+    """Compress a stream of chunks in gzip."""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def get_tip_id() -> int:
+    """Id of the last block, or 0 if there is no block."""
+    tip = get_tip()
+    return tip['id'] if tip else 0
 
 
 @api.route('/ping')
@@ -25,10 +124,10 @@ def get_public_url():
 
 @api.route(Node.get_nodes_endpoint, methods=['GET'])
 def get_nodes():
-    nodes = Node.query.filter(
+    nodes = Node.live().filter(
         Node.last_connected_at >= datetime.datetime.utcnow() -
         datetime.timedelta(minutes=60 * 3)
-    ).order_by(Node.last_connected_at.desc()).limit(2500).all()
+    ).limit(2500).all()
 
     nodes = [n.url for n in nodes]
 
@@ -74,77 +173,182 @@ def post_node():
 
 @api.route(Node.get_blocks_endpoint, methods=['GET'])
 def get_blocks():
+    tip_id = get_tip_id()
+    from_ = request.values.get('from', 1, type=int)
+    to = request.values.get('to', tip_id, type=int)
+    # Clients continue from the last block they got.
+    to = min(to, from_ + BLOCKS_LIMIT - 1)
+    hashes = [hash_ for hash_, in db.session.query(Block.hash).filter(
+        Block.id >= from_,
+        Block.id <= to
+    ).order_by(Block.id.asc())]
+    bencoded = accepts_bencode()
+
+    def iter_blocks():
+        for start in range(from_, to + 1, BLOCKS_BATCH_SIZE):
+            yield from Block.query.options(
+                selectinload(Block.moves)
+            ).filter(
+                Block.id >= start,
+                Block.id <= min(start + BLOCKS_BATCH_SIZE - 1, to)
+            ).order_by(Block.id.asc())
+
+    def generate_bencode():
+        yield b'd6:blocksl'
+        for block in iter_blocks():
+            yield bencode(block.encode())
+        yield b'ee'
+
+    def generate_json():
+        yield '{"blocks": ['
+        for i, block in enumerate(iter_blocks()):
+            yield (', ' if i else '') + json.dumps(block.serialize(
+                use_bencode=False,
+                include_suffix=True,
+                include_moves=True,
+                include_hash=True
+            ))
+        yield ']}\n'
+
+    def render():
+        if bencoded:
+            return Response(stream_with_context(generate_bencode()),
+                            mimetype=BENCODE_MIMETYPE)
+        return Response(stream_with_context(generate_json()),
+                        mimetype='application/json')
+
+    # Blocks requested beyond the last block can come later.
+    return cacheable(hashes, tip_id - to,
+                     BENCODE_MIMETYPE if bencoded else 'application/json',
+                     render)
+
+
+@api.route(Node.get_block_headers_endpoint)
+def get_block_headers():
     last_block = Block.query.order_by(Block.id.desc()).first()
     from_ = request.values.get('from', 1, type=int)
     to = request.values.get(
         'to',
         last_block.id if last_block else 0,
         type=int)
+    # Headers are small, but don't let a request scan the whole chain.
+    to = min(to, from_ + HEADERS_LIMIT - 1)
     blocks = Block.query.filter(
         Block.id >= from_,
         Block.id <= to
     ).order_by(Block.id.asc())
-    return jsonify(blocks=[b.serialize(use_bencode=False,
-                                       include_suffix=True,
-                                       include_moves=True,
-                                       include_hash=True)
-                           for b in blocks])
+    return jsonify(headers=[b.serialize(use_bencode=False,
+                                        include_suffix=True,
+                                        include_hash=True)
+                            for b in blocks])
 
 
-@api.route('/blocks/<string:block_hash>')
-def get_block_by_hash(block_hash):
-    block = Block.query.filter_by(hash=block_hash).first()
+@api.route(Node.post_block_locator_endpoint, methods=['POST'])
+def post_block_locator():
+    locator = (request.get_json() or {}).get('locator')
+    if (not isinstance(locator, list) or len(locator) > LOCATOR_LIMIT or
+       not all(isinstance(h, str) for h in locator)):
+        return jsonify(result='failed',
+                       message='Invalid locator.'), 400
+    block = Block.query.filter(
+        Block.hash.in_(locator)
+    ).order_by(Block.id.desc()).first()
     if block:
         block = block.serialize(use_bencode=False,
                                 include_suffix=True,
-                                include_moves=True,
                                 include_hash=True)
     return jsonify(block=block)
 
 
+@api.route('/blocks/<string:block_hash>')
+def get_block_by_hash(block_hash):
+    return block_response(serializations.get(
+        f'block/{block_hash}',
+        lambda: serialize_block(Block.query.filter_by(hash=block_hash).first())
+    ))
+
+
 @api.route('/blocks/<int:block_id>')
 def get_block_by_id(block_id):
-    block = Block.query.get(block_id)
+    return block_response(serializations.get(
+        f'block/{block_id}',
+        lambda: serialize_block(Block.query.get(block_id))
+    ))
+
+
+def serialize_block(block: typing.Optional[Block]) -> typing.Optional[dict]:
     if block:
-        block = block.serialize(use_bencode=False,
-                                include_suffix=True,
-                                include_moves=True,
-                                include_hash=True)
-    return jsonify(block=block)
+        return block.serialize(use_bencode=False,
+                               include_suffix=True,
+                               include_moves=True,
+                               include_hash=True)
+
+
+def block_response(block: typing.Optional[dict]) -> Response:
+    if not block:
+        return jsonify(block=None)
+    return cacheable([block['hash']], get_tip_id() - block['id'],
+                     'application/json', lambda: jsonify(block=block))
 
 
 @api.route('/blocks/last')
 def get_last_block():
-    block = Block.query.order_by(Block.id.desc()).first()
-    if block:
-        block = block.serialize(use_bencode=False,
-                                include_suffix=True,
-                                include_moves=True,
-                                include_hash=True)
-    return jsonify(block=block)
+    block = get_tip()
+    return cacheable([block['hash']] if block else [], 0, 'application/json',
+                     lambda: jsonify(block=block))
+
+
+@api.route(Node.get_block_wait_endpoint)
+def wait_block():
+    timeout = request.values.get('timeout', 15, type=float)
+    if not math.isfinite(timeout) or timeout < 0:
+        return jsonify(result='failed',
+                       message="invalid timeout."), 400
+    block = wait_for_tip(request.values.get('after') or None,
+                         min(timeout, WAIT_TIMEOUT_LIMIT))
+    if not block:
+        return '', 204
+    return jsonify(block={k: v for k, v in block.items() if k != 'moves'})
 
 
 @api.route('/moves/<string:move_id>')
 def get_moves(move_id):
-    move = Move.query.get(move_id)
-    if move:
-        move = move.serialize(False, True, True, True)
+    def load():
+        move = Move.query.get(move_id)
+        return move and move.serialize(False, True, True, True)
+
+    # Moves which aren't confirmed yet change when they are.
+    move = serializations.get(f'move/{move_id}', load,
+                              lambda move: move and move['block'])
     return jsonify(move=move)
 
 
 @api.route(Node.post_block_endpoint, methods=['POST'])
 def post_block():
-    new_block = request.get_json()
+    if request.mimetype == BENCODE_MIMETYPE:
+        encoded, sent_node_url = get_bencoded_body('block')
+        try:
+            new_block = encoded and Block.decode(encoded)
+        except (BencodeDecodeError, KeyError, TypeError, ValueError):
+            new_block = None
+        if new_block and sent_node_url:
+            new_block['sent_node'] = sent_node_url
+    else:
+        new_block = request.get_json()
     last_block = Block.query.order_by(Block.id.desc()).first()
 
     if not new_block:
         return jsonify(result='failed',
                        message="empty block."), 400
+    if not isinstance(new_block, dict) or \
+       type(new_block.get('id')) is not int or \
+       not isinstance(new_block.get('prev_hash'), (str, type(None))) or \
+       not isinstance(new_block.get('moves'), list):
+        return jsonify(result='failed',
+                       message="invalid block."), 400
 
     if not last_block and new_block['id'] != 1:
-        Block.sync(
-            Node.query.order_by(
-                Node.last_connected_at.desc()).first())
+        Block.sync(Node.live().first())
         return jsonify(result='failed',
                        message="new block isn't our next block."), 403
 
@@ -152,18 +356,25 @@ def post_block():
        (new_block['id'] != last_block.id + 1 or
        new_block['prev_hash'] != last_block.hash)):
         if new_block['id'] > last_block.id + 1:
-            Block.sync(
-                Node.query.order_by(
-                    Node.last_connected_at.desc()).first())
+            Block.sync(Node.live().first())
         return jsonify(result='failed',
                        message="new block isn't our next block."), 403
 
-    block = Block.deserialize(new_block)
+    try:
+        block = Block.deserialize(new_block)
+    except (KeyError, TypeError, ValueError):
+        return jsonify(result='failed',
+                       message="invalid block."), 400
+    known = Move.get_many(map(serialized_move_id, new_block['moves']))
 
     for new_move in new_block['moves']:
-        move = Move.query.get(new_move['id'])
+        move = known.get(serialized_move_id(new_move))
         if not move:
-            Move.deserialize(new_move, block.id)
+            try:
+                move = Move.deserialize(new_move, block.id)
+            except (BencodeDecodeError, KeyError, TypeError, ValueError):
+                return jsonify(result='failed',
+                               message="invalid move."), 400
         if not move.valid:
             return jsonify(result='failed',
                            message=f"move {move.id} isn't valid."), 400
@@ -178,12 +389,10 @@ def post_block():
     except IntegrityError:
         return jsonify(result='failed',
                        message="This node already has this block."), 400
-    sent_node = Node()
-    if 'sent_node' in new_block:
-        sent_node.url = new_block['sent_node']
-    block_broadcast.delay(
+    update_tip()
+    relay_queue.relay_block(
         block.id,
-        sent_node_url=sent_node.url,
+        sent_node_url=new_block.get('sent_node'),
         my_node_url=f'{request.scheme}://{request.host}'
     )
     return jsonify(result='success')
@@ -191,14 +400,32 @@ def post_block():
 
 @api.route(Node.post_move_endpoint, methods=['POST'])
 def post_move():
-    new_move = request.get_json()
-    move = Move.query.get(new_move['id'])
+    if request.mimetype == BENCODE_MIMETYPE:
+        new_move, sent_node_url = get_bencoded_body('move')
+        if isinstance(new_move, str):
+            new_move = new_move.encode('utf-8')
+        elif not isinstance(new_move, bytes):
+            new_move = None
+    else:
+        new_move = request.get_json()
+        if new_move and not isinstance(new_move, dict):
+            return jsonify(result='failed',
+                           message="invalid move."), 400
+        sent_node_url = new_move and new_move.get('sent_node')
+    if not new_move:
+        return jsonify(result='failed',
+                       message="empty move."), 400
+    move = Move.query.get(serialized_move_id(new_move))
 
     if move:
         return jsonify(result='success')
 
     if not move:
-        move = Move.deserialize(new_move)
+        try:
+            move = Move.deserialize(new_move)
+        except (BencodeDecodeError, KeyError, TypeError, ValueError):
+            return jsonify(result='failed',
+                           message="invalid move."), 400
 
     if not move.valid:
         return jsonify(result='failed',
@@ -210,13 +437,239 @@ def post_move():
     except IntegrityError:
         return jsonify(result='failed',
                        message="This node already has this move."), 400
-    sent_node = Node()
-    if 'sent_node' in new_move:
-        sent_node.url = new_move['sent_node']
-
-    move_broadcast.delay(
+    relay_queue.relay_move(
         move.id,
-        sent_node_url=sent_node.url,
+        sent_node_url=sent_node_url,
         my_node_url=f'{request.scheme}://{request.host}'
     )
     return jsonify(result='success')
+
+
+@api.route(Node.post_inventory_endpoint, methods=['POST'])
+def post_inventory():
+    """Tell which of the announced moves and blocks this node doesn't have
+    yet, so that the node announced them sends only those to
+    :func:`post_moves_batch()` and :func:`post_blocks_batch()`.
+    """
+    inventory = request.get_json(silent=True)
+    try:
+        move_ids = inventory.get('moves', [])
+        blocks = [(b['id'], b['hash']) for b in inventory.get('blocks', [])]
+    except (AttributeError, KeyError, TypeError):
+        return jsonify(result='failed',
+                       message="invalid inventory."), 400
+    if not isinstance(move_ids, list) or \
+       not all(isinstance(i, str) for i in move_ids):
+        return jsonify(result='failed',
+                       message="invalid inventory."), 400
+    if len(move_ids) > POST_MOVES_LIMIT or len(blocks) > POST_BLOCKS_LIMIT:
+        return jsonify(result='failed',
+                       message="too large inventory."), 400
+
+    known = Move.get_many(move_ids)
+    wanted_moves = [move_id for move_id in dict.fromkeys(move_ids)
+                    if move_id not in known]
+    # Blocks this node has, or forks it would refuse, aren't wanted.
+    last_id = get_tip_id()
+    wanted_blocks = [block_hash for block_id, block_hash in blocks
+                     if isinstance(block_id, int) and block_id > last_id]
+    return jsonify(moves=wanted_moves, blocks=wanted_blocks)
+
+
+@api.route(Node.post_blocks_batch_endpoint, methods=['POST'])
+def post_blocks_batch():
+    """Receive consecutive blocks at once.  Blocks are added until an
+    invalid one, and the result of each block is reported in order.
+    """
+    if request.mimetype == BENCODE_MIMETYPE:
+        encoded, sent_node_url = get_bencoded_body('blocks')
+        try:
+            new_blocks = [Block.decode(b) for b in encoded]
+        except (BencodeDecodeError, KeyError, TypeError, ValueError):
+            new_blocks = None
+    else:
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            return jsonify(result='failed',
+                           message="invalid blocks."), 400
+        new_blocks = body.get('blocks')
+        sent_node_url = body.get('sent_node')
+
+    if not new_blocks or not isinstance(new_blocks, list):
+        return jsonify(result='failed',
+                       message="empty blocks."), 400
+    if len(new_blocks) > POST_BLOCKS_LIMIT:
+        return jsonify(result='failed',
+                       message=f"more than {POST_BLOCKS_LIMIT} blocks."), 400
+    try:
+        ids = [b['id'] for b in new_blocks]
+    except (KeyError, TypeError):
+        return jsonify(result='failed',
+                       message="invalid blocks."), 400
+    if not all(type(id_) is int for id_ in ids):
+        return jsonify(result='failed',
+                       message="invalid block ids."), 400
+    if ids != list(range(ids[0], ids[0] + len(ids))):
+        return jsonify(result='failed',
+                       message="blocks aren't consecutive."), 400
+
+    results = {}
+    last_block = Block.query.order_by(Block.id.desc()).first()
+    last_id = last_block.id if last_block else 0
+    known = {}
+    if ids[0] <= last_id:
+        known.update(
+            db.session.query(Block.id, Block.hash).filter(
+                Block.id.between(ids[0], min(ids[-1], last_id))
+            )
+        )
+    for new_block in new_blocks:
+        if new_block['id'] in known:
+            if new_block.get('hash') == known[new_block['id']]:
+                results[new_block['id']] = {'result': 'known'}
+            else:
+                results[new_block['id']] = {
+                    'result': 'failed',
+                    'message': "new block isn't our next block.",
+                }
+    new_blocks = [b for b in new_blocks if b['id'] > last_id]
+
+    if new_blocks and (
+        new_blocks[0]['id'] != last_id + 1 or
+        (last_block and new_blocks[0].get('prev_hash') != last_block.hash)
+    ):
+        if new_blocks[0]['id'] > last_id + 1:
+            Block.sync(Node.live().first())
+        for new_block in new_blocks:
+            results[new_block['id']] = {
+                'result': 'failed',
+                'message': "new block isn't our next block.",
+            }
+        new_blocks = []
+
+    added = []
+    if new_blocks:
+        try:
+            added = Block.add_serialized_blocks(new_blocks)
+        except (InvalidBlockError, InvalidMoveError) as e:
+            # Keep the valid blocks before the invalid one.
+            invalid_id = e.args[-1]
+            if isinstance(e, InvalidMoveError):
+                message = f"move {e.args[0]} isn't valid."
+            else:
+                message = "new block isn't valid."
+            for new_block in new_blocks:
+                if new_block['id'] == invalid_id:
+                    results[invalid_id] = {'result': 'failed',
+                                           'message': message}
+                elif new_block['id'] > invalid_id:
+                    results[new_block['id']] = {
+                        'result': 'failed',
+                        'message': "previous block isn't valid.",
+                    }
+            new_blocks = [b for b in new_blocks if b['id'] < invalid_id]
+            if new_blocks:
+                added = Block.add_serialized_blocks(new_blocks)
+        except (BencodeDecodeError, KeyError, TypeError, ValueError):
+            db.session.rollback()
+            return jsonify(result='failed',
+                           message="invalid blocks."), 400
+
+    if added:
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            for block in added:
+                results[block.id] = {
+                    'result': 'failed',
+                    'message': "This node already has this block.",
+                }
+            added = []
+        else:
+            update_tip()
+    for block in added:
+        results[block.id] = {'result': 'success'}
+        relay_queue.relay_block(
+            block.id,
+            sent_node_url=sent_node_url,
+            my_node_url=f'{request.scheme}://{request.host}'
+        )
+    return jsonify(results=[dict(results[i], id=i) for i in ids])
+
+
+@api.route(Node.post_moves_batch_endpoint, methods=['POST'])
+def post_moves_batch():
+    """Receive many moves at once.  Moves this node already has are looked
+    up in a query, the rest are verified together and committed at once,
+    and the result of each move is reported in order.
+    """
+    if request.mimetype == BENCODE_MIMETYPE:
+        new_moves, sent_node_url = get_bencoded_body('moves')
+        if isinstance(new_moves, list):
+            new_moves = [
+                m.encode('utf-8') if isinstance(m, str) else m
+                for m in new_moves
+            ]
+    else:
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            return jsonify(result='failed',
+                           message="invalid moves."), 400
+        new_moves = body.get('moves')
+        sent_node_url = body.get('sent_node')
+
+    if not new_moves or not isinstance(new_moves, list):
+        return jsonify(result='failed',
+                       message="empty moves."), 400
+    if len(new_moves) > POST_MOVES_LIMIT:
+        return jsonify(result='failed',
+                       message=f"more than {POST_MOVES_LIMIT} moves."), 400
+    try:
+        ids = [serialized_move_id(m) for m in new_moves]
+    except (KeyError, TypeError):
+        return jsonify(result='failed',
+                       message="invalid moves."), 400
+    if not all(isinstance(i, str) for i in ids):
+        return jsonify(result='failed',
+                       message="invalid move ids."), 400
+
+    results = {move_id: {'result': 'known'}
+               for move_id in Move.get_many(ids)}
+    unknown = {}
+    for move_id, new_move in zip(ids, new_moves):
+        if move_id not in results:
+            unknown.setdefault(move_id, new_move)
+    verified = verify_moves(list(unknown.values()))
+
+    added = []
+    for move_id, new_move in unknown.items():
+        if not verified[move_id]:
+            results[move_id] = {'result': 'failed',
+                                'message': f"move {move_id} isn't valid."}
+            continue
+        move = Move.deserialize(new_move)
+        db.session.add(move)
+        added.append(move)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another request added some of them meanwhile; add the rest one
+        # by one.
+        db.session.rollback()
+        for move in list(added):
+            db.session.add(move)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                results[move.id] = {'result': 'known'}
+                added.remove(move)
+    for move in added:
+        results[move.id] = {'result': 'success'}
+        relay_queue.relay_move(
+            move.id,
+            sent_node_url=sent_node_url,
+            my_node_url=f'{request.scheme}://{request.host}'
+        )
+    return jsonify(results=[dict(results[i], id=i) for i in ids])
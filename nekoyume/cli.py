@@ -1,3 +1,9 @@
+import datetime
+from hashlib import sha256
+import json
+import platform
+import threading
+
 import click
 import time
 import os
@@ -5,11 +11,18 @@ import os
 from ptpython.repl import embed
 from raven import Client
 from secp256k1 import PrivateKey
+from sqlalchemy.exc import SQLAlchemyError
 
-from nekoyume.models import Node, Block, Move, User, get_my_public_url
+from nekoyume import hashcash, models
+from nekoyume.models import (PROTOCOL_VERSION, BlockWatcher, Node, Block,
+                             Move, User, get_my_public_url)
 from nekoyume.app import app, db
 
 
+#: The number of nodes to watch for new blocks while mining.
+WATCH_NODES: int = 5
+
+
 class PrivateKeyType(click.ParamType):
     name = 'private key'
 
@@ -27,23 +40,62 @@ def cli():
     pass
 
 
+def recent_nodes(limit: int=1) -> list:
+    return Node.live().limit(limit).all()
+
+
+def check_health_forever(interval: float=models.HEALTH_CHECK_INTERVAL / 2):
+    """Check health of nodes in a background thread while a command
+    runs.  The web process doesn't run one of its own, as it shares the
+    database with ``nekoyume sync`` (see Procfile), and its broadcasts
+    record the health of the nodes they reach anyway.
+    """
+    def check():
+        with app.app_context():
+            while True:
+                try:
+                    Node.check_health()
+                except SQLAlchemyError:
+                    db.session.rollback()
+                time.sleep(interval)
+
+    threading.Thread(target=check, daemon=True).start()
+
+
 @cli.command()
 @click.argument('private_key', type=PrivateKeyType())
-def neko(private_key: PrivateKey):
+@click.option('--workers',
+              type=click.IntRange(1),
+              default=1,
+              help='Number of processes to mine with')
+def neko(private_key: PrivateKey, workers: int):
     app.app_context().push()
     Client(os.environ.get('SENTRY_DSN'))
+    check_health_forever()
+    watcher = BlockWatcher()
 
     while True:
-        Block.sync()
+        Block.sync(workers=workers)
+        # Give up mining as soon as another node has a new block.
+        last_block = Block.query.order_by(Block.id.desc()).first()
+        arrived = watcher.watch(
+            [n.url for n in recent_nodes(limit=WATCH_NODES)],
+            last_block.id if last_block else 0,
+            last_block and last_block.hash,
+        )
         block = User(private_key).create_block(
             [m
              for m in Move.query.filter_by(block=None).limit(20).all()
              if m.valid],
             click=click,
+            workers=workers,
+            cancel=arrived.is_set,
         )
         if block:
             block.broadcast()
             click.echo(block)
+        else:
+            click.echo('A new block arrived; mining the next one...')
 
 
 @cli.command()
@@ -59,7 +111,11 @@ def shell():
 @click.option('--sync/--skip-sync',
               default=False,
               help='Synchronize after initialization or skip it')
-def init(seed, sync):
+@click.option('--workers',
+              type=click.IntRange(1),
+              default=os.cpu_count(),
+              help='Number of processes to verify moves with')
+def init(seed, sync, workers):
     click.echo('Creating database...')
     db.create_all()
     click.echo(f'Updating node... (seed: {seed})')
@@ -69,11 +125,15 @@ def init(seed, sync):
         Node.update()
     if sync:
         click.echo('Syncing blocks...')
-        Block.sync(click=click)
+        Block.sync(click=click, workers=workers)
 
 
 @cli.command()
-def sync():
+@click.option('--workers',
+              type=click.IntRange(1),
+              default=os.cpu_count(),
+              help='Number of processes to verify moves with')
+def sync(workers):
     Client(os.environ.get('SENTRY_DSN'))
     public_url = get_my_public_url()
     if public_url:
@@ -84,22 +144,36 @@ def sync():
     if not engine.dialect.has_table(engine.connect(), Block.__tablename__):
         click.echo("You need to initialize. try `nekoyume init`.")
         return False
+    check_health_forever()
     while True:
         try:
             prev_id = Block.query.order_by(Block.id.desc()).first().id
         except AttributeError:
             prev_id = 0
-        Block.sync(click=click)
+        Block.sync(click=click, workers=workers)
         try:
-            if prev_id == Block.query.order_by(Block.id.desc()).first().id:
+            last_block = Block.query.order_by(Block.id.desc()).first()
+            if prev_id == last_block.id:
                 click.echo("The blockchain is up to date.")
-                time.sleep(15)
+                nodes = recent_nodes()
+                if nodes:
+                    # Sync again as soon as the node has a new block.
+                    nodes[0].wait_for_block(last_block.id, last_block.hash)
+                else:
+                    time.sleep(15)
         except AttributeError:
             click.echo(("There is no well-connected node. "
                         "please check you network."))
             break
 
 
+@cli.command()
+def migrate():
+    """Migrate the database of an older version to the current schema."""
+    click.echo('Migrating database...')
+    models.migrate(click=click)
+
+
 @cli.command()
 def doctor():
     id = 1
@@ -138,6 +212,77 @@ def repair():
     db.session.commit()
 
 
+@cli.command()
+@click.option('--min-difficulty',
+              type=click.IntRange(0),
+              default=0,
+              help='The lowest difficulty to mine')
+@click.option('--max-difficulty',
+              type=click.IntRange(0),
+              default=24,
+              help='The highest difficulty to mine')
+@click.option('--samples',
+              type=click.IntRange(1),
+              default=3,
+              help='Number of blocks to mine for each difficulty')
+@click.option('--workers',
+              type=click.IntRange(1),
+              default=1,
+              help='Number of processes to mine with')
+@click.option('--output',
+              type=click.File('w'),
+              default=None,
+              help='File to save the results to as JSON')
+@click.option('--compare',
+              type=click.File('r'),
+              default=None,
+              help='Results saved by --output before to compare with')
+def bench(min_difficulty, max_difficulty, samples, workers, output, compare):
+    """Measure hashrate and time to solution of mining."""
+    baseline = {}
+    if compare:
+        baseline = {r['bits']: r for r in json.load(compare)['results']}
+    results = []
+    for bits in range(min_difficulty, max_difficulty + 1):
+        runs = []
+        for _ in range(samples):
+            block = Block(
+                id=100000,
+                version=PROTOCOL_VERSION,
+                creator='0x' + os.urandom(20).hex(),
+                prev_hash=sha256(os.urandom(32)).hexdigest(),
+                root_hash=sha256(os.urandom(32)).hexdigest(),
+                difficulty=bits,
+                created_at=datetime.datetime.utcnow(),
+            )
+            runs.append(hashcash.benchmark(block.serialize(), bits, workers))
+        hashes = sum(r['hashes'] for r in runs)
+        seconds = sum(r['seconds'] for r in runs)
+        result = dict(
+            bits=bits,
+            hashrate=hashes / seconds if seconds else 0.0,
+            time_to_solution=seconds / samples,
+            runs=runs,
+        )
+        results.append(result)
+        line = (f'difficulty {bits:2}: {result["hashrate"]:12.0f} H/s, '
+                f'{result["time_to_solution"]:9.4f}s to solution')
+        if bits in baseline and baseline[bits]['hashrate']:
+            ratio = result['hashrate'] / baseline[bits]['hashrate']
+            line += f' ({ratio:.2f}x hashrate of the baseline)'
+        click.echo(line)
+    if output:
+        json.dump(dict(
+            python=platform.python_version(),
+            machine=platform.machine(),
+            cpu_count=os.cpu_count(),
+            workers=workers,
+            samples=samples,
+            created_at=str(datetime.datetime.utcnow()),
+            results=results,
+        ), output, indent=2)
+
+
 @cli.command()
 @click.option('--host',
               default='127.0.0.1',
@@ -6,7 +6,8 @@ from flask_babel import Babel
 from secp256k1 import PrivateKey
 from sqlalchemy import func
 
-from nekoyume.models import cache, db, LevelUp, Move, Node, User
+from nekoyume.models import cache, db, LevelUp, Move, User
+from nekoyume.tasks import relay_queue
 
 
 game = Blueprint('game', __name__, template_folder='templates')
@@ -114,8 +115,8 @@ def get_new_novice():
                 'charisma': '13'})
             db.session.add(move)
             db.session.commit()
-            move.broadcast(
-                my_node=Node(url=f'{request.scheme}://{request.host}')
+            relay_queue.relay_move(
+                move.id, my_node_url=f'{request.scheme}://{request.host}'
             )
         return render_template('new.html', move=move)
     return redirect(url_for('.get_dashboard'))
@@ -149,5 +150,7 @@ def post_move():
                               request.values.get('item3'))
 
     if move:
-        move.broadcast(my_node=Node(url=f'{request.scheme}://{request.host}'))
+        relay_queue.relay_move(
+            move.id, my_node_url=f'{request.scheme}://{request.host}'
+        )
     return redirect(url_for('.get_dashboard'))
@@ -19,19 +19,76 @@ any particular fields or delimiters in *challenge*.  E.g., you might get:
     '000090605c0a82a7aeac7bd99cb61002f16ced96e649edd58b8baaa3c747304a'
 
 Notice that :func:`_mint()` behaves deterministically, finding the same suffix
-every time it is passed the same arguments.
+every time it is passed the same arguments, unless it is cancelled, in which
+case it returns ``None`` instead of a suffix.
 """
+import collections
 import hashlib
-import math
+import multiprocessing
 import sys
+import time
+import typing
 
 
-def _mint(challenge: bytes, bits: int) -> bytes:
+#: The number of counters each worker of :func:`_mint()` examines at once
+#: when it runs in parallel.
+CHUNK_SIZE: int = 1 << 16
+
+#: The number of candidate suffixes :func:`_search()` generates at once.
+BATCH_SIZE: int = 1 << 12
+
+
+class MintProgress(typing.NamedTuple):
+    """Progress of :func:`_mint()` passed to its *progress* callback."""
+
+    #: leading zero bits being searched for
+    bits: int
+    #: the number of hashes tried so far
+    hashes: int
+    #: seconds elapsed since minting started
+    elapsed: float
+
+    @property
+    def hashrate(self) -> float:
+        """Hashes per second."""
+        return self.hashes / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def expected_hashes(self) -> int:
+        """The number of hashes a challenge takes on average."""
+        return 1 << max(0, self.bits)
+
+    @property
+    def eta(self) -> float:
+        """Estimated seconds left until the expected number of hashes is
+        tried.  It is zero once minting took longer than expected.
+        """
+        if not self.hashrate:
+            return float('inf')
+        return max(0, self.expected_hashes - self.hashes) / self.hashrate
+
+
+def _mint(challenge: bytes, bits: int, workers: int=1,
+          progress: typing.Callable[[MintProgress], None]=None,
+          cancel: typing.Callable[[], bool]=None,
+          interval: float=1.0) -> typing.Optional[bytes]:
     """Answer a generalized Hashcash_ challenge.
 
     This function accepts a generalized prefix *challenge*,
     and returns only a suffix that produces the requested SHA leading zeros.
 
+    If *workers* is greater than 1, the counter space is split into chunks
+    of :const:`CHUNK_SIZE` which are searched by a pool of that many
+    processes.  Chunks are collected in order, so the answer is the same
+    one a single process would find.
+
+    If *progress* is given, it is called with a :class:`MintProgress`
+    at most once every *interval* seconds while minting.
+
+    If *cancel* is given, it is called before minting and then at most once
+    every *interval* seconds.  As soon as it returns ``True`` minting is
+    given up and ``None`` is returned instead of a suffix.
+
     .. _Hashcash: https://en.wikipedia.org/wiki/Hashcash
 
     """
@@ -39,20 +96,139 @@ def _mint(challenge: bytes, bits: int) -> bytes:
         raise TypeError(
             f'challenge must be an instance of bytes, not {challenge}'
         )
+    if cancel and cancel():
+        return None
+    if workers > 1:
+        return _mint_parallel(challenge, bits, workers,
+                              progress, cancel, interval)
+    return _search(challenge, bits, 1,
+                   progress=progress, cancel=cancel, interval=interval)
+
+
+def _search(challenge: bytes, bits: int, start: int, stop: int=None,
+            progress: typing.Callable[[MintProgress], None]=None,
+            cancel: typing.Callable[[], bool]=None,
+            interval: float=1.0):
+    """Search counters in ``[start, stop)`` for a suffix of *challenge*.
+
+    It returns ``None`` if no counter in the range is an answer or
+    *cancel* returned ``True``.  If *stop* is ``None`` it never gives up.
+
+    The *challenge* is hashed only once; every candidate continues from a
+    copy of that SHA-256 state, so the cost per candidate doesn't depend on
+    the length of the *challenge*.  Candidates are generated in batches of
+    :const:`BATCH_SIZE` suffixes of the same length, and a digest is
+    compared with the target as a whole instead of being scanned bit by bit.
+    """
     # These function aliases purpose to prevent global lookup which is way
     # slower than local lookup in Python VM.
-    log2 = math.log2
-    sha256 = hashlib.sha256
+    copy = hashlib.sha256(challenge).copy
     byteorder = sys.byteorder
+    target = _target(bits)
+    started_at = checked_at = time.monotonic()
+
+    counter = start
+    while stop is None or counter < stop:
+        # The suffix grows by a byte whenever the counter reaches the next
+        # power of 256, so it's enough to compute the length once a batch.
+        length = (counter.bit_length() + 7) // 8
+        batch_stop = min(counter + BATCH_SIZE, 1 << (8 * length))
+        if stop is not None:
+            batch_stop = min(batch_stop, stop)
+        for answer in [c.to_bytes(length, byteorder)
+                       for c in range(counter, batch_stop)]:
+            h = copy()
+            h.update(answer)
+            if h.digest() < target:
+                return answer
+        counter = batch_stop
+        if progress or cancel:
+            now = time.monotonic()
+            if now - checked_at >= interval:
+                checked_at = now
+                if progress:
+                    progress(MintProgress(bits, counter - start,
+                                          now - started_at))
+                if cancel and cancel():
+                    return None
+    return None
+
+
+def _target(bits: int) -> bytes:
+    """Return the bytes every digest with *bits* leading zero bits sorts
+    before.  A digest has enough leading zero bits if and only if it is
+    less than the returned bytes.
+    """
+    if bits <= 0:
+        # Greater than any 32 bytes long digest.
+        return b'\xff' * 33
+    return (1 << (256 - bits)).to_bytes(32, 'big')
 
-    counter = 1
-    while 1:
-        answer_bytes_length = 1 + int(log2(counter) // 8)
-        answer = counter.to_bytes(answer_bytes_length, byteorder)
-        digest = sha256(challenge + answer).digest()
-        if has_leading_zero_bits(digest, bits):
-            return answer
-        counter += 1
+
+def _search_chunk(args):
+    return _search(*args)
+
+
+def _mint_parallel(challenge: bytes, bits: int, workers: int,
+                   progress: typing.Callable[[MintProgress], None]=None,
+                   cancel: typing.Callable[[], bool]=None,
+                   interval: float=1.0) -> typing.Optional[bytes]:
+    pool = multiprocessing.Pool(workers)
+    started_at = checked_at = time.monotonic()
+    hashes = 0
+    try:
+        pending = collections.deque()
+        start = 1
+        while True:
+            # Keep a couple of chunks queued per worker so that no worker
+            # idles while the oldest chunk is being waited on.
+            while len(pending) < workers * 2:
+                pending.append(pool.apply_async(
+                    _search_chunk,
+                    ((challenge, bits, start, start + CHUNK_SIZE),)
+                ))
+                start += CHUNK_SIZE
+            # Don't block on the oldest chunk for longer than the interval
+            # so that cancel can be checked in time.
+            pending[0].wait(max(interval, 0.01))
+            if pending[0].ready():
+                answer = pending.popleft().get()
+                if answer is not None:
+                    return answer
+                hashes += CHUNK_SIZE
+            if progress or cancel:
+                now = time.monotonic()
+                if now - checked_at >= interval:
+                    checked_at = now
+                    if progress:
+                        progress(MintProgress(bits, hashes,
+                                              now - started_at))
+                    if cancel and cancel():
+                        return None
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def benchmark(challenge: bytes, bits: int, workers: int=1) -> dict:
+    """Mint *challenge* and measure how long it took.
+
+    It returns a :class:`dict` with the ``bits``, the number of ``hashes``
+    tried, the elapsed ``seconds`` and the ``hashrate`` in hashes per
+    second.
+    """
+    started_at = time.monotonic()
+    answer = _mint(challenge, bits, workers=workers)
+    seconds = time.monotonic() - started_at
+    # The search starts from the counter 1 and the answer is the counter
+    # itself, so it tells how many hashes were tried.
+    hashes = int.from_bytes(answer, sys.byteorder)
+    return dict(
+        bits=bits,
+        hashes=hashes,
+        seconds=seconds,
+        hashrate=hashes / seconds if seconds else 0.0,
+    )
 
 
 def check(stamp, resource=None, bits=None,
@@ -6,21 +6,29 @@ Models
 game moves.
 """
 
+import collections
+import concurrent.futures
 import datetime
+import itertools
 from hashlib import sha256 as h
+import multiprocessing
 import os
+import queue
 import re
+import threading
+import time
+import typing
 
-from bencode import bencode
+from bencode import BencodeDecodeError, bdecode, bencode
 from flask_caching import Cache
 from flask_sqlalchemy import SQLAlchemy
 from keccak import sha3_256
 import requests
 from secp256k1 import PrivateKey, PublicKey
-from sqlalchemy import or_
+from sqlalchemy import event, inspect, or_
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.ext.associationproxy import association_proxy
-from sqlalchemy.orm.collections import attribute_mapped_collection
+from sqlalchemy.ext.mutable import MutableDict
+from sqlalchemy.orm import Session, object_session
 from sqlalchemy.sql.functions import char_length
 import tablib
 
@@ -38,10 +46,273 @@ from nekoyume import hashcash
 
 
 PROTOCOL_VERSION: int = 2
+#: The media type of blocks and moves bencoded in the bytes their hashes
+#: are made of, instead of JSON with hex strings.
+BENCODE_MIMETYPE: str = 'application/x-bencode'
+#: What nodes accept when they download blocks.  Older nodes respond in JSON.
+BLOCKS_ACCEPT: str = f'{BENCODE_MIMETYPE}, application/json;q=0.9'
+#: The maximum number of blocks a node responds with at once.  Clients don't
+#: ask for more, as they would get only this many.
+BLOCKS_LIMIT: int = 1000
+#: How many move ids to look up in a query.  SQLite doesn't allow more than
+#: 999 parameters in a statement.
+MOVES_QUERY_SIZE: int = 500
+#: The number of moves a page of blocks has to have for :meth:`Block.sync()`
+#: to verify them with worker processes.  For fewer moves forking takes
+#: longer than verifying them in this process.
+POOL_MOVES: int = 256
 db = SQLAlchemy()
 cache = Cache()
 
 
+class LRUCache():
+    """A bounded mapping that forgets the least recently used items first.
+
+    It counts :attr:`hits` and :attr:`misses` of :meth:`get()` to help
+    sizing it.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+#: Results of signature verification of recent moves, keyed by their id,
+#: signature and public key.
+verified_moves = LRUCache(maxsize=2 ** 15)
+
+
+class SerializationCache():
+    """Serialized blocks and moves ready to be sent, cached in a per-process
+    :class:`LRUCache` in front of the shared :data:`cache`.
+
+    Keys carry a generation which is bumped whenever blocks or moves are
+    deleted (e.g., by :meth:`Block.sync()` on a reorg), so entries made
+    before are never served again.  How much is kept depends on the
+    configured backend of :data:`cache`: if it fails nothing is cached,
+    as deletions by other processes couldn't be told, and if it keeps
+    nothing (e.g., ``'null'``) only the per-process cache is used, and
+    only deletions by this process are told.
+    """
+
+    generation_key = 'serialization_generation'
+
+    def __init__(self, maxsize: int, timeout: int=60 * 60 * 24):
+        self.local = LRUCache(maxsize)
+        self.timeout = timeout
+        self.local_generation = 0
+
+    def shared_generation(self) -> typing.Optional[int]:
+        try:
+            return cache.get(self.generation_key) or 0
+        except Exception:
+            return None
+
+    def get(self, key: str, load: typing.Callable[[], typing.Any],
+            cacheable: typing.Callable[[typing.Any], bool]=None):
+        """
+        Get the cached value of the given key, or load it.
+
+        :param       key: key of the value.
+        :param      load: a function which loads the value.
+        :param cacheable: a function which tells if a loaded value can be
+                          cached.  Values other than :const:`None` are
+                          cached by default.
+        """
+        # The generation has to be read before the value is loaded, lest a
+        # value loaded before a deletion be cached after it.
+        shared_generation = self.shared_generation()
+        if shared_generation is None:
+            return load()
+        local_key = (shared_generation, self.local_generation, key)
+        value = self.local.get(local_key)
+        if value is not None:
+            return value
+        shared_key = f'serialized/{shared_generation}/{key}'
+        try:
+            value = cache.get(shared_key)
+        except Exception:
+            value = None
+        if value is None:
+            value = load()
+            if not (cacheable(value) if cacheable else value is not None):
+                return value
+            try:
+                cache.set(shared_key, value, timeout=self.timeout)
+            except Exception:
+                pass
+        self.local[local_key] = value
+        return value
+
+    def invalidate(self) -> None:
+        """Forget every entry, in every process."""
+        self.local_generation += 1
+        self.local.clear()
+        try:
+            cache.cache.inc(self.generation_key)
+        except Exception:
+            pass
+
+
+#: Serialized blocks and moves served to other nodes.
+serializations = SerializationCache(maxsize=2 ** 10)
+
+
+#: Notified whenever a commit of this process changes the last block.
+tip_changed = threading.Condition()
+#: Key of the last block in the shared :data:`cache`.
+TIP_CACHE_KEY = 'chain_tip'
+#: Seconds the last block is cached for at most.
+TIP_CACHE_TIMEOUT = 60
+
+
+def get_tip(session=db.session) -> typing.Optional[dict]:
+    """Get the last block serialized with its suffix, moves and hash, from
+    the shared :data:`cache` if possible.
+    """
+    try:
+        tip = cache.get(TIP_CACHE_KEY)
+    except Exception:
+        tip = None
+    if tip is None:
+        tip = update_tip(session)
+    return tip['block']
+
+
+def wait_for_tip(after: typing.Optional[str], timeout: float,
+                 session=db.session,
+                 interval: float=0.5) -> typing.Optional[dict]:
+    """
+    Wait until the last block isn't the block of the given hash, and get
+    it as :func:`get_tip()` does.  Commits of this process wake it up at
+    once, and ones of other processes are noticed through the shared
+    :data:`cache` in ``interval`` seconds.  It returns :const:`None` on
+    timeout.
+
+    :param    after: hash of the last block the caller has, if any.
+    :param  timeout: seconds to wait for at most.
+    :param  session: database session to get the last block from.
+    :param interval: seconds between checks of the shared cache.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        tip = get_tip(session)
+        if (tip and tip['hash']) != after:
+            return tip
+        # Don't hold a connection while waiting.
+        session.close()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        with tip_changed:
+            tip_changed.wait(min(interval, remaining))
+
+
+class BlockWatcher():
+    """Watches nodes for a block higher than the one being mined on, from a
+    single background thread which is reused for every block, so no thread
+    is left behind in a long poll when the block to watch changes.
+    """
+
+    def __init__(self, timeout: float=15):
+        #: seconds of a long poll
+        self.timeout = timeout
+        self.watching = None
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def watch(self, urls: typing.List[str], block_id: int,
+              block_hash: typing.Optional[str]) -> threading.Event:
+        """
+        Watch for a block higher than the given block, instead of the
+        previous one.  It returns :class:`threading.Event` set as soon as
+        any of the nodes has one.
+
+        :param       urls: URLs of the nodes to watch.
+        :param   block_id: id of the last block we have, or 0.
+        :param block_hash: hash of the last block we have, if any.
+        """
+        arrived = threading.Event()
+        with self.condition:
+            self.watching = (urls, block_id, block_hash, arrived)
+            self.condition.notify_all()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        return arrived
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not (self.watching and self.watching[0]):
+                    self.condition.wait()
+                watching = self.watching
+            urls, block_id, block_hash, arrived = watching
+            for url in urls:
+                if self.watching is not watching:
+                    break
+                timeout = self.timeout / len(urls)
+                try:
+                    arrived_at_node = Node(url=url).wait_for_block(
+                        block_id, block_hash, timeout=timeout
+                    )
+                except Exception:
+                    # A node misbehaving mustn't stop watching the others;
+                    # take it as if it timed out.
+                    time.sleep(timeout)
+                    continue
+                if arrived_at_node:
+                    with self.condition:
+                        arrived.set()
+                        if self.watching is watching:
+                            self.watching = None
+                    break
+
+
+def update_tip(session=db.session) -> dict:
+    """Put the last block of the database in the shared :data:`cache`.
+    It should be called whenever blocks are committed.
+    """
+    block = session.query(Block).order_by(Block.id.desc()).first()
+    tip = {'block': block and block.serialize(use_bencode=False,
+                                              include_suffix=True,
+                                              include_moves=True,
+                                              include_hash=True)}
+    try:
+        cache.set(TIP_CACHE_KEY, tip, timeout=TIP_CACHE_TIMEOUT)
+    except Exception:
+        pass
+    return tip
+
+
 def get_my_public_url():
     if 'PUBLIC_URL' in os.environ:
         return os.environ['PUBLIC_URL']
@@ -64,6 +335,215 @@ def get_my_public_url():
         return None
 
 
+#: The number of nodes :meth:`Node.broadcast()` sends to at once.
+BROADCAST_WORKERS: int = 32
+#: Seconds to wait for each node in :meth:`Node.broadcast()`.
+BROADCAST_TIMEOUT: float = 3
+#: Seconds to wait for a node to respond to a health check.
+HEALTH_CHECK_TIMEOUT: float = 3
+#: Seconds between health checks of a node which responds.
+HEALTH_CHECK_INTERVAL: int = 60
+#: The longest seconds between health checks of a node which doesn't.
+HEALTH_CHECK_MAX_BACKOFF: int = 60 * 60 * 6
+#: Consecutive failures after which a node isn't used anymore until it
+#: responds again.
+LIVE_FAILURES: int = 3
+#: Consecutive failures after which a node isn't checked anymore.
+EVICTION_FAILURES: int = 10
+#: How much statistics of nodes keep their old values when they are
+#: updated with a new one.
+STATS_WEIGHT: float = 0.75
+#: Bytes of blocks the cost of a node is estimated for.
+SYNC_PAGE_BYTES: int = 1 << 20
+#: Bytes per second a node is assumed to send before it is measured.
+DEFAULT_THROUGHPUT: float = 1 << 18
+#: The process id and the session of :func:`http_session()`.
+broadcast_session = None
+#: The process id and the executor of :func:`get_broadcast_executor()`.
+broadcast_executor = None
+broadcast_executor_lock = threading.Lock()
+
+
+class BroadcastResult(typing.NamedTuple):
+    """What a node did with an object sent by :meth:`Node.broadcast()`."""
+
+    #: URL of the node
+    url: str
+    #: whether the node accepted the object
+    ok: bool
+    #: seconds taken until the node responded or failed
+    latency: float
+    #: why the node failed, if it did
+    error: typing.Optional[str]
+
+
+def http_session() -> requests.Session:
+    """A :class:`requests.Session` shared by the threads of this process,
+    which keeps connections to nodes alive between broadcasts.  A node is
+    kept only as many connections as were made to it at once, which is
+    usually one, whichever threads send to it.
+    """
+    global broadcast_session
+    with broadcast_executor_lock:
+        pid, session = broadcast_session or (None, None)
+        if pid != os.getpid():
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=256, pool_maxsize=BROADCAST_WORKERS
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            broadcast_session = os.getpid(), session
+        return session
+
+
+def get_broadcast_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """The threads :meth:`Node.broadcast()` sends with.  They live as long
+    as the process, but a forked process gets its own.
+    """
+    global broadcast_executor
+    with broadcast_executor_lock:
+        pid, executor = broadcast_executor or (None, None)
+        if pid != os.getpid():
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=BROADCAST_WORKERS
+            )
+            broadcast_executor = os.getpid(), executor
+        return executor
+
+
+def broadcast_result(url: str, started_at: float,
+                     responses: typing.List[requests.Response]
+                     ) -> BroadcastResult:
+    """Make the result of a node out of the responses it sent."""
+    latency = time.monotonic() - started_at
+    for response in responses:
+        if not response.ok:
+            return BroadcastResult(
+                url, False, latency,
+                f'{response.status_code} {response.reason}'
+            )
+    return BroadcastResult(url, True, latency, None)
+
+
+def post_to_node(url: str, endpoint: str,
+                 serialized_obj: dict) -> typing.Tuple[BroadcastResult, bool]:
+    """Send an object to a node for :meth:`Node.broadcast()`.  It returns
+    the result and whether the node responded at all.
+    """
+    started_at = time.monotonic()
+    try:
+        response = http_session().post(url + endpoint, json=serialized_obj,
+                                       timeout=BROADCAST_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        return BroadcastResult(url, False, time.monotonic() - started_at,
+                               type(e).__name__), False
+    return broadcast_result(url, started_at, [response]), True
+
+
+def announce_to_node(url: str, inventory: dict,
+                     moves: typing.Dict[str, bytes],
+                     blocks: typing.Dict[str, dict],
+                     legacy: typing.List[typing.Tuple[str, dict]]
+                     ) -> typing.Tuple[BroadcastResult, bool]:
+    """
+    Announce moves and blocks to a node for :meth:`Node.announce()`, and
+    send it only the ones it wants.  A node which doesn't know inventories
+    gets all of them in full.  It returns the result and whether the node
+    responded at all.
+
+    :param       url: URL of the node.
+    :param inventory: ids of the moves and the blocks to announce.
+    :param     moves: moves encoded by :meth:`Move.encode()` by their id.
+    :param    blocks: blocks encoded by :meth:`Block.encode()` by their
+                      hash, in order.
+    :param    legacy: endpoints and objects to post to nodes which don't
+                      know inventories.
+    """
+    started_at = time.monotonic()
+    session = http_session()
+    responded = False
+    responses = []
+    try:
+        response = session.post(url + Node.post_inventory_endpoint,
+                                json=inventory, timeout=BROADCAST_TIMEOUT)
+        responded = True
+        if response.status_code == 404:
+            for endpoint, serialized_obj in legacy:
+                responses.append(session.post(url + endpoint,
+                                              json=serialized_obj,
+                                              timeout=BROADCAST_TIMEOUT))
+        else:
+            responses.append(response)
+            wanted = response.json() if response.ok else {}
+            wanted_blocks = set(wanted.get('blocks', []))
+            batches = [
+                (Node.post_moves_batch_endpoint, 'moves',
+                 [moves[i] for i in wanted.get('moves', []) if i in moves]),
+                (Node.post_blocks_batch_endpoint, 'blocks',
+                 [b for h, b in blocks.items() if h in wanted_blocks]),
+            ]
+            for endpoint, key, objs in batches:
+                if not objs:
+                    continue
+                body = {key: objs}
+                if inventory.get('sent_node'):
+                    body['sent_node'] = inventory['sent_node']
+                responses.append(session.post(
+                    url + endpoint, data=bencode(body),
+                    headers={'Content-Type': BENCODE_MIMETYPE},
+                    timeout=BROADCAST_TIMEOUT
+                ))
+    except (requests.exceptions.RequestException, AttributeError, TypeError,
+            ValueError) as e:
+        return BroadcastResult(url, False, time.monotonic() - started_at,
+                               type(e).__name__), responded
+    return broadcast_result(url, started_at, responses), True
+
+
+def ping_node(url: str) -> typing.Tuple[BroadcastResult, bool]:
+    """Check if a node responds to ``/ping`` in time for
+    :meth:`Node.check_health()`.  It returns the result and whether the node
+    responded at all.
+    """
+    started_at = time.monotonic()
+    try:
+        response = http_session().get(f'{url}/ping',
+                                      timeout=HEALTH_CHECK_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        return BroadcastResult(url, False, time.monotonic() - started_at,
+                               type(e).__name__), False
+    result = broadcast_result(url, started_at, [response])
+    if result.ok and response.text != 'pong':
+        result = result._replace(ok=False, error='no pong')
+    return result, True
+
+
+def smooth(old: typing.Optional[float], new: float) -> float:
+    """Update a statistic of a node by an exponential moving average."""
+    if old is None:
+        return new
+    return STATS_WEIGHT * old + (1 - STATS_WEIGHT) * new
+
+
+def get_last_block(url: str) -> typing.Tuple[typing.Optional[dict], float,
+                                             bool]:
+    """Get the last block of a node for :meth:`Node.probe()`.  It returns
+    the block, seconds it took, and whether the node responded properly.
+    """
+    started_at = time.monotonic()
+    try:
+        response = http_session().get(
+            f'{url}{Node.get_blocks_endpoint}/last',
+            timeout=HEALTH_CHECK_TIMEOUT
+        )
+        block = response.json()['block']
+    except (requests.exceptions.RequestException, KeyError, TypeError,
+            ValueError):
+        return None, time.monotonic() - started_at, False
+    return block, time.monotonic() - started_at, True
+
+
 class Node(db.Model):
     """This object contains node information you know."""
 
@@ -71,12 +551,34 @@ class Node(db.Model):
     url = db.Column(db.String, primary_key=True)
     #: last connected datetime of the node
     last_connected_at = db.Column(db.DateTime, nullable=False, index=True)
+    #: smoothed round-trip time of the node in seconds
+    rtt = db.Column(db.Float, nullable=True)
+    #: number of health checks the node has failed in a row
+    failures = db.Column(db.Integer, nullable=False, default=0,
+                         server_default='0', index=True)
+    #: last health check datetime of the node
+    last_checked_at = db.Column(db.DateTime, nullable=True)
+    #: when the node should be checked next
+    next_check_at = db.Column(db.DateTime, nullable=True, index=True)
+    #: id of the last block the node reported
+    height = db.Column(db.Integer, nullable=True)
+    #: smoothed bytes per second the node sent blocks at
+    throughput = db.Column(db.Float, nullable=True)
+    #: smoothed ratio of requests to the node which failed
+    error_rate = db.Column(db.Float, nullable=False, default=0,
+                           server_default='0')
 
     get_nodes_endpoint = '/nodes'
     post_node_endpoint = '/nodes'
     get_blocks_endpoint = '/blocks'
+    get_block_headers_endpoint = '/blocks/headers'
+    post_block_locator_endpoint = '/blocks/locator'
+    get_block_wait_endpoint = '/blocks/wait'
     post_block_endpoint = '/blocks'
     post_move_endpoint = '/moves'
+    post_blocks_batch_endpoint = '/blocks/batch'
+    post_moves_batch_endpoint = '/moves/batch'
+    post_inventory_endpoint = '/inventory'
 
     @classmethod
     def get(cls, url, session=db.session):
@@ -84,8 +586,11 @@ class Node(db.Model):
         node = get()
         if node:
             return node
-        elif requests.get(f'{url}/ping').text == 'pong':
-            node = Node(url=url, last_connected_at=datetime.datetime.utcnow())
+        started_at = time.monotonic()
+        if requests.get(f'{url}/ping',
+                        timeout=HEALTH_CHECK_TIMEOUT).text == 'pong':
+            node = Node(url=url, rtt=time.monotonic() - started_at,
+                        last_connected_at=datetime.datetime.utcnow())
             if session:
                 session.add(node)
                 try:
@@ -103,40 +608,241 @@ class Node(db.Model):
     def update(cls, node=None):
         """
         Update recent node list by scrapping other nodes' information.
+        Nodes are scrapped and new nodes are pinged concurrently.
         """
         if not node or not node.url:
-            recent_nodes = Node.query.filter(
-                Node.last_connected_at >= datetime.datetime.utcnow() -
-                datetime.timedelta(minutes=60 * 3)
-            ).order_by(Node.last_connected_at.desc()).limit(2500)
-            if Node.query.count() == 0:
+            recent_nodes = cls.live().limit(2500).all()
+            if not recent_nodes:
+                # Every node failing may as well mean our network was
+                # down; ask them all again.
+                recent_nodes = Node.query.order_by(
+                    cls.last_connected_at.desc()
+                ).limit(2500).all()
+            if not recent_nodes:
                 recent_nodes = [cls(url='http://seed.nekoyu.me')]
         else:
             recent_nodes = [node]
 
-        for n in recent_nodes:
+        def get_nodes(url):
             try:
-                response = requests.get(f"{n.url}{Node.get_nodes_endpoint}")
-            except requests.exceptions.ConnectionError:
-                continue
-            except requests.exceptions.Timeout:
-                continue
-            for url in response.json()['nodes']:
-                try:
-                    Node.get(url)
-                except requests.exceptions.ConnectionError:
-                    continue
-                except requests.exceptions.Timeout:
-                    continue
-            else:
-                continue
-            break
+                return requests.get(f"{url}{Node.get_nodes_endpoint}",
+                                    timeout=HEALTH_CHECK_TIMEOUT
+                                    ).json()['nodes']
+            except (requests.exceptions.RequestException, KeyError,
+                    TypeError, ValueError):
+                return []
+
+        executor = get_broadcast_executor()
+        known = {url for url, in db.session.query(cls.url)}
+        urls = [
+            url
+            for urls in executor.map(get_nodes,
+                                     [n.url for n in recent_nodes])
+            for url in urls
+            if isinstance(url, str) and url not in known
+        ]
+        urls = list(dict.fromkeys(urls))
+        now = datetime.datetime.utcnow()
+        for url, (result, _) in zip(urls, executor.map(ping_node, urls)):
+            if result.ok:
+                db.session.add(cls(
+                    url=url, rtt=result.latency, last_connected_at=now,
+                    last_checked_at=now,
+                    next_check_at=now + datetime.timedelta(
+                        seconds=HEALTH_CHECK_INTERVAL
+                    ),
+                ))
 
         db.session.commit()
 
+    @classmethod
+    def live(cls, session=db.session):
+        """
+        Query nodes which have responded lately, the most responsive
+        first: by their failures in a row, and then by their round-trip
+        time.
+        """
+        return session.query(cls).filter(
+            cls.failures < LIVE_FAILURES
+        ).order_by(
+            cls.failures,
+            cls.rtt.is_(None),
+            cls.rtt,
+            cls.last_connected_at.desc(),
+        )
+
+    @classmethod
+    def check_health(cls, session=db.session,
+                     now: datetime.datetime=None
+                     ) -> typing.List[BroadcastResult]:
+        """
+        Ping nodes due to be checked concurrently, and record their
+        round-trip times and failures.  A node which fails is checked
+        again after exponentially longer intervals, and isn't checked
+        anymore after :const:`EVICTION_FAILURES` failures in a row.  It
+        returns a :class:`BroadcastResult` of each node checked.
+
+        :param session: database session to update nodes with.
+        :param     now: when the check is, or the current time.
+        """
+        now = now or datetime.datetime.utcnow()
+        nodes = session.query(cls).filter(
+            cls.failures < EVICTION_FAILURES,
+            (cls.next_check_at == None) | (cls.next_check_at <= now)  # noqa
+        ).all()
+        executor = get_broadcast_executor()
+        results = list(executor.map(ping_node, [n.url for n in nodes]))
+        for node, (result, responded) in zip(nodes, results):
+            if responded:
+                node.last_connected_at = now
+            node.checked(result.ok, now, session, result.latency)
+        session.commit()
+        return [result for result, _ in results]
+
+    def checked(self, ok: bool, now: datetime.datetime,
+                session=db.session, rtt: float=None):
+        """
+        Record a health check of this node, or a request to it which tells
+        as much.  A node which fails is checked again after exponentially
+        longer intervals, and isn't checked anymore after
+        :const:`EVICTION_FAILURES` failures in a row.
+
+        :param      ok: whether the node is healthy.
+        :param     now: when the node was checked.
+        :param session: database session the node is in.
+        :param     rtt: round-trip time of the check, if it measured one.
+        """
+        self.last_checked_at = now
+        if ok:
+            self.failures = 0
+            if rtt is not None:
+                self.rtt = smooth(self.rtt, rtt)
+            delay = HEALTH_CHECK_INTERVAL
+        else:
+            self.failures = (self.failures or 0) + 1
+            if self.failures >= EVICTION_FAILURES:
+                # The node is kept rather than deleted, as a broadcast in
+                # another session may be recording its statistics.
+                self.next_check_at = None
+                return
+            delay = min(HEALTH_CHECK_INTERVAL * 2 ** self.failures,
+                        HEALTH_CHECK_MAX_BACKOFF)
+        self.next_check_at = now + datetime.timedelta(seconds=delay)
+
+    @classmethod
+    def probe(cls, nodes: typing.Sequence['Node']) -> typing.Dict[str, dict]:
+        """
+        Get the last blocks of the given nodes concurrently, and record
+        their heights, round-trip times and errors.  It returns the last
+        block of each node which has any, by its URL.
+
+        :param nodes: nodes to probe.
+        """
+        executor = get_broadcast_executor()
+        last_blocks = {}
+        probed = executor.map(get_last_block, [n.url for n in nodes])
+        for node, (block, elapsed, ok) in zip(nodes, probed):
+            node.record(ok)
+            if ok:
+                node.rtt = smooth(node.rtt, elapsed)
+                node.height = block['id'] if block else 0
+            if block:
+                last_blocks[node.url] = block
+        cls.save_stats(nodes)
+        return last_blocks
+
+    @staticmethod
+    def save_stats(nodes: typing.Iterable['Node']):
+        """Commit statistics of the given nodes, if they are stored."""
+        for session in {object_session(n) for n in nodes} - {None}:
+            session.commit()
+
+    def record(self, ok: bool, elapsed: float=None, size: int=None):
+        """
+        Update statistics of this node with a request made to it.
+
+        :param      ok: whether the request succeeded.
+        :param elapsed: seconds the request took.
+        :param    size: bytes the node responded with.
+        """
+        self.error_rate = smooth(self.error_rate or 0, 0 if ok else 1)
+        if ok and size and elapsed:
+            self.throughput = smooth(self.throughput, size / elapsed)
+
+    @property
+    def cost(self) -> float:
+        """Expected seconds to download :const:`SYNC_PAGE_BYTES` of blocks
+        from this node, including retries of failed requests.
+        """
+        rtt = HEALTH_CHECK_TIMEOUT if self.rtt is None else self.rtt
+        seconds = rtt + SYNC_PAGE_BYTES / (self.throughput or
+                                           DEFAULT_THROUGHPUT)
+        return seconds / (1 - min(self.error_rate or 0, 0.9))
+
+    def wait_for_block(self, block_id: int, block_hash: typing.Optional[str],
+                       timeout: float=15, interval: float=3) -> bool:
+        """
+        Wait until this node has a block higher than the given block.  It
+        asks the node to respond as soon as its last block changes, or polls
+        its last block every ``interval`` seconds if the node doesn't
+        support it.  It returns :const:`False` on timeout.
+
+        :param    block_id: id of the last block we have, or 0.
+        :param  block_hash: hash of the last block we have, if any.
+        :param     timeout: seconds to wait for at most.
+        :param    interval: seconds between polls.
+        """
+        deadline = time.monotonic() + timeout
+        after = block_hash
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            try:
+                response = requests.get(
+                    f'{self.url}{Node.get_block_wait_endpoint}',
+                    params={'after': after or '', 'timeout': remaining},
+                    timeout=remaining + 5
+                )
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                break
+            if response.status_code == 204:
+                return False
+            elif response.status_code != 200:
+                break
+            # Older nodes take the path for a hash of a block, and respond
+            # with no block.
+            try:
+                block = response.json()['block']
+                new_block_id, after = block['id'], block['hash']
+            except (ValueError, KeyError, TypeError):
+                break
+            if new_block_id > block_id:
+                return True
+            # The node is behind us; wait for its next block.
+
+        # The node doesn't support long polling; poll its last block.
+        while True:
+            try:
+                block = requests.get(
+                    f'{self.url}{Node.get_blocks_endpoint}/last', timeout=3
+                ).json()['block']
+                if block and block['id'] > block_id:
+                    return True
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout, ValueError, KeyError,
+                    TypeError):
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(interval, remaining))
+
     def ping(self):
         try:
-            result = requests.get(f'{self.url}/ping').text == 'pong'
+            result = requests.get(f'{self.url}/ping',
+                                  timeout=HEALTH_CHECK_TIMEOUT).text == 'pong'
             if result:
                 self.last_connected_at = datetime.datetime.utcnow()
             return result
@@ -151,9 +857,11 @@ class Node(db.Model):
                   serialized_obj: dict,
                   sent_node=None,
                   my_node=None,
-                  session=db.session) -> bool:
+                  session=db.session) -> typing.List[BroadcastResult]:
         """
-        It broadcast `serialized_obj` to every nodes you know.
+        It broadcast `serialized_obj` to every nodes you know, at most
+        :const:`BROADCAST_WORKERS` nodes at once.  It returns a
+        :class:`BroadcastResult` of each node.
 
         :param        endpoint: endpoint of node to broadcast
         :param  serialized_obj: object that will be broadcasted.
@@ -163,24 +871,94 @@ class Node(db.Model):
                                 received node ignore my node when they
                                 broadcast received object.
         """
+        if my_node:
+            serialized_obj = dict(serialized_obj, sent_node=my_node.url)
+        return cls.fan_out(
+            lambda url: post_to_node(url, endpoint, serialized_obj),
+            sent_node, session
+        )
 
-        for node in session.query(cls):
-            if sent_node and sent_node.url == node.url:
-                continue
-            try:
-                if my_node:
-                    serialized_obj['sent_node'] = my_node.url
-                requests.post(node.url + endpoint, json=serialized_obj,
-                              timeout=3)
-                node.last_connected_at = datetime.datetime.utcnow()
-                session.add(node)
-            except requests.exceptions.ConnectionError:
-                continue
-            except requests.exceptions.Timeout:
-                continue
+    @classmethod
+    def announce(cls,
+                 moves: typing.Sequence['Move']=(),
+                 blocks: typing.Sequence['Block']=(),
+                 sent_node=None,
+                 my_node=None,
+                 session=db.session) -> typing.List[BroadcastResult]:
+        """
+        Announce ids of moves and blocks to every nodes you know, and send
+        each node only the ones it doesn't have yet.  Unlike
+        :meth:`broadcast()`, an object which many nodes relay crosses the
+        network about once per node.
+
+        :param     moves: moves to announce.
+        :param    blocks: consecutive blocks to announce.
+        :param sent_node: sent :class:`nekoyume.models.Node`.
+                          this node ignore sent node.
+        :param   my_node: my :class:`nekoyume.models.Node`.
+                          received node ignore my node when they
+                          broadcast received object.
+        """
+        blocks = sorted(blocks, key=lambda b: b.id)
+        inventory = {
+            'moves': [m.id for m in moves],
+            'blocks': [{'id': b.id, 'hash': b.hash} for b in blocks],
+        }
+        legacy = [
+            (cls.post_move_endpoint, m.serialize(False, True, True))
+            for m in moves
+        ] + [
+            (cls.post_block_endpoint, b.serialize(False, True, True, True))
+            for b in blocks
+        ]
+        if my_node:
+            inventory['sent_node'] = my_node.url
+            legacy = [(endpoint, dict(obj, sent_node=my_node.url))
+                      for endpoint, obj in legacy]
+        encoded_moves = {m.id: m.encode() for m in moves}
+        encoded_blocks = collections.OrderedDict(
+            (b.hash, b.encode()) for b in blocks
+        )
+        return cls.fan_out(
+            lambda url: announce_to_node(url, inventory, encoded_moves,
+                                         encoded_blocks, legacy),
+            sent_node, session
+        )
+
+    @classmethod
+    def fan_out(cls,
+                send: typing.Callable[
+                    [str], typing.Tuple[BroadcastResult, bool]
+                ],
+                sent_node=None,
+                session=db.session) -> typing.List[BroadcastResult]:
+        """
+        Call ``send`` with the URL of every live nodes but the sent node,
+        at most :const:`BROADCAST_WORKERS` nodes at once, and record
+        whether each node responded as its health check.
+
+        :param      send: a function which sends something to a node and
+                          returns its :class:`BroadcastResult` and whether
+                          the node responded at all.
+        :param sent_node: :class:`nekoyume.models.Node` to skip.
+        """
+        nodes = [
+            node for node in cls.live(session)
+            if not (sent_node and sent_node.url == node.url)
+        ]
+        executor = get_broadcast_executor()
+        futures = [executor.submit(send, node.url) for node in nodes]
+        results = []
+        now = datetime.datetime.utcnow()
+        for node, future in zip(nodes, futures):
+            result, responded = future.result()
+            if responded:
+                node.last_connected_at = now
+            node.checked(responded, now, session)
+            results.append(result)
 
         session.commit()
-        return True
+        return results
 
 
 class Block(db.Model):
@@ -219,6 +997,10 @@ class Block(db.Model):
 
     @classmethod
     def deserialize(cls, serialized: dict) -> 'Block':
+        suffix = serialized['suffix']
+        if not isinstance(suffix, bytes):
+            # Hex in JSON; see also :meth:`decode()`.
+            suffix = bytes.fromhex(suffix)
         return cls(
             id=serialized['id'],
             version=serialized['version'],
@@ -230,51 +1012,121 @@ class Block(db.Model):
             prev_hash=serialized['prev_hash'],
             hash=serialized['hash'],
             difficulty=serialized['difficulty'],
-            suffix=bytes.fromhex(serialized['suffix']),
+            suffix=suffix,
             root_hash=serialized['root_hash'],
         )
 
+    @classmethod
+    def decode(cls, encoded: dict) -> dict:
+        """
+        Turn a block encoded by :meth:`encode()` into the form of
+        ``serialize(use_bencode=False, include_suffix=True,
+        include_moves=True, include_hash=True)``, which
+        :meth:`deserialize()` and :meth:`add_serialized_blocks()` take.
+        Its suffix and moves are kept in bytes, and its hash is made of the
+        received header instead of being received.
+
+        :param encoded: a block encoded by :meth:`encode()`.
+        """
+        header = as_bytes(encoded['header'])
+        suffix = as_bytes(encoded['suffix'])
+        serialized = dict(bdecode(header))
+        serialized.setdefault('prev_hash', None)
+        serialized.update(
+            suffix=suffix,
+            hash=h(header + suffix).hexdigest(),
+            moves=[as_bytes(m) for m in encoded['moves']],
+        )
+        return serialized
+
+    @classmethod
+    def parse_response(cls, response: requests.Response) -> list:
+        """Get serialized blocks from a response of the blocks endpoint,
+        either in :const:`BENCODE_MIMETYPE` or in JSON.
+        """
+        if response.headers.get('Content-Type', '').startswith(
+            BENCODE_MIMETYPE
+        ):
+            return [cls.decode(b) for b in bdecode(response.content)['blocks']]
+        return response.json()['blocks']
+
+    def encode(self) -> dict:
+        """Serialize this block into its header, suffix and moves, in
+        the bytes their hashes are made of, to be bencoded in
+        :const:`BENCODE_MIMETYPE`.
+        """
+        return {
+            'header': self.serialize(),
+            'suffix': self.suffix,
+            'moves': [m.encode() for m in self.moves],
+        }
+
     @property
     def valid(self) -> bool:
         """Check if this object is valid or not"""
-        stamp = self.serialize() + self.suffix
-        valid = (self.hash == h(stamp).hexdigest())
-        valid = valid and hashcash.check(stamp, self.suffix, self.difficulty)
+        valid = self.valid_header
+        for move in self.moves:
+            valid = valid and move.valid
+        return valid
 
+    @staticmethod
+    def root_hash_of(move_ids: typing.Iterable[str]) -> str:
+        """The root hash of a block which has moves of the given ids."""
+        return h(''.join(sorted(move_ids)).encode('utf-8')).hexdigest()
+
+    @property
+    def valid_header(self) -> bool:
+        """Check if this object is valid or not, except for signatures of
+        its moves.
+        """
+        return self.valid_header_in(db.session)
+
+    def valid_header_in(self, session) -> bool:
+        """Same as :attr:`valid_header`, but look the previous blocks up
+        in the given database session and its :class:`HeaderWindow`.
+        """
+        valid = self.valid_proof(session)
         valid = valid and (
             len(self.serialize(True, True, True, True)) <= Block.size_limit
         )
+        valid = valid and self.root_hash == Block.root_hash_of(
+            m.id for m in self.moves
+        )
+        return valid
+
+    def valid_proof(self, session,
+                    window: typing.Optional['HeaderWindow']=None) -> bool:
+        """Check the hash and hashcash of this block, and whether it follows
+        the previous block with the right difficulty.  Unlike
+        :attr:`valid_header` it doesn't need moves of the block.
+
+        :param session: database session to look blocks not in the window
+                        up.
+        :param  window: :class:`HeaderWindow` which has headers of blocks
+                        before this block.  The window of the session by
+                        default.
+        """
+        if window is None:
+            window = HeaderWindow.of(session)
+        stamp = self.serialize() + self.suffix
+        valid = (self.hash == h(stamp).hexdigest())
+        valid = valid and hashcash.check(stamp, self.suffix, self.difficulty)
 
         if self.id > 1:
-            prev_block = Block.query.get(self.id - 1)
+            prev_block = window.get(self.id - 1, session)
             if not prev_block:
                 return False
             valid = valid and self.prev_hash == prev_block.hash
 
-            difficulty = prev_block.difficulty
-            difficulty_check_block = Block.query.get(
-                max(1, self.id - 10)
+            avg_timedelta = window.average_timedelta(
+                self.id, self.created_at, session
             )
-            avg_timedelta = (
-                (self.created_at - difficulty_check_block.created_at) /
-                (self.id - difficulty_check_block.id)
+            valid = valid and self.difficulty == retarget(
+                prev_block.difficulty, avg_timedelta
             )
-            if avg_timedelta <= datetime.timedelta(0, 5):
-                valid = valid and self.difficulty == max(0, difficulty + 1)
-            elif avg_timedelta > datetime.timedelta(0, 15):
-                valid = valid and self.difficulty == max(0, difficulty - 1)
-            else:
-                valid = valid and self.difficulty == difficulty
         else:
             valid = valid and self.prev_hash is None
             valid = valid and self.difficulty == 0
-
-        valid = valid and self.root_hash == h(
-            ''.join(sorted((m.id for m in self.moves))).encode('utf-8')
-        ).hexdigest()
-
-        for move in self.moves:
-            valid = valid and move.valid
         return valid
 
     def serialize(self,
@@ -290,6 +1142,18 @@ class Block(db.Model):
         :param  include_moves: check if you want to include linked moves.
         :param   include_hash: check if you want to include block hash.
         """
+        if use_bencode:
+            memo = serialization_memo(self)
+            memo_key = (include_suffix, include_moves, include_hash)
+            # A serialization with moves stays valid only while the same
+            # moves keep their own memos, which are dropped on any change.
+            move_memos = [serialization_memo(m) for m in self.moves] \
+                if include_moves else []
+            memoized, memoized_move_memos = memo.get(memo_key, (None, None))
+            if memoized is not None and \
+               len(memoized_move_memos) == len(move_memos) and \
+               all(a is b for a, b in zip(memoized_move_memos, move_memos)):
+                return memoized
         binary = (lambda x: x) if use_bencode else bytes.hex
         serialized = dict(
             id=self.id,
@@ -317,15 +1181,17 @@ class Block(db.Model):
             if self.prev_hash is None:
                 del serialized['prev_hash']
             serialized = bencode(serialized)
+            memo[memo_key] = serialized, move_memos
         return serialized
 
     def broadcast(self,
                   sent_node: bool=None,
                   my_node: bool=None,
                   session=db.session,
-                  click=None) -> bool:
+                  click=None) -> typing.List[BroadcastResult]:
         """
-        It broadcast this block to every nodes you know.
+        It broadcast this block to every nodes you know by
+        :meth:`Node.announce()`.
 
        :param       sent_node: sent :class:`nekoyume.models.Node`.
                                this node ignore sent node.
@@ -333,42 +1199,38 @@ class Block(db.Model):
                                received node ignore my node when they
                                broadcast received object.
         """
-        return Node.broadcast(Node.post_block_endpoint,
-                              self.serialize(False, True, True, True),
-                              sent_node, my_node, session)
+        return Node.announce(blocks=[self], sent_node=sent_node,
+                             my_node=my_node, session=session)
 
     @classmethod
-    def sync(cls, node: Node=None, session=db.session, click=None) -> bool:
+    def sync(cls, node: Node=None, session=db.session, click=None,
+             workers: int=1) -> bool:
         """
         Sync blockchain with other node.
 
-        :param node: sync target :class:`nekoyume.models.Node`.
+        :param    node: sync target :class:`nekoyume.models.Node`.
+        :param workers: number of processes to verify signatures of moves
+                        with, once a page of blocks has at least
+                        :const:`POOL_MOVES` moves.
         """
         if not node:
-            nodes = Node.query.order_by(
-                Node.last_connected_at.desc()
-            ).limit(10)
+            nodes = Node.live().limit(10).all()
         else:
             nodes = [node]
 
         if not nodes:
             return False
 
+        last_blocks = Node.probe(nodes)
+        #: Heights of the nodes, to download blocks from all of them.
+        heights = {url: block['id'] for url, block in last_blocks.items()}
         node_last_block = None
-        for n in nodes:
-            try:
-                response = requests.get(
-                    f"{n.url}{Node.get_blocks_endpoint}/last",
-                    timeout=3
-                )
-                if (not node_last_block or
-                   node_last_block['id'] < response.json()['block']['id']):
-                    node_last_block = response.json()['block']
-                    node = n
-            except requests.exceptions.ConnectionError:
-                continue
-            except requests.exceptions.Timeout:
-                continue
+        if heights:
+            # The fastest node among the ones which have the longest chain.
+            height = max(heights.values())
+            node = min((n for n in nodes if heights.get(n.url) == height),
+                       key=lambda n: n.cost)
+            node_last_block = last_blocks[node.url]
 
         last_block = session.query(Block).order_by(Block.id.desc()).first()
 
@@ -395,67 +1257,687 @@ class Block(db.Model):
                 return find_branch_point(value, mid - 1)
 
         if last_block:
+            branch_point = cls.locate_branch_point(node, last_block.id,
+                                                   session)
+        else:
+            branch_point = 0
+        if branch_point is None:
+            # The node doesn't know block locators; search it by halves.
             # TODO: Very hard to understand. fix this easily.
             if find_branch_point(last_block.id,
                                  last_block.id) == last_block.id:
                 branch_point = last_block.id
             else:
                 branch_point = find_branch_point(0, last_block.id)
+
+        # Check the chain of the node by its headers before deleting our
+        # blocks and downloading its moves.
+        headers = cls.fetch_headers(node, branch_point + 1,
+                                    node_last_block['id'])
+        if headers is not None:
+            if click:
+                click.echo(f'Verifying {len(headers)} block headers...')
+            hashes = cls.verify_headers(headers, session)
+            if not hashes:
+                return True
+            to = max(hashes)
         else:
-            branch_point = 0
+            hashes = None
+            to = node_last_block['id']
 
         for block in session.query(Block).filter(Block.id > branch_point):
             for move in block.moves:
                 move.block_id = None
             session.delete(block)
+        window = HeaderWindow.of(session)
+        window.truncate(branch_point)
 
         # Flush the above deletions to the database.
         # If we don't flush here,
         # stale objects can be fetched when validating blocks.
         session.flush()
 
-        from_ = branch_point + 1
-        limit = 1000
-        while True:
-            if click:
-                click.echo(f'Syncing blocks...(from: {from_})')
-            response = requests.get(f"{node.url}{Node.get_blocks_endpoint}",
-                                    params={'from': from_,
-                                            'to': from_ + limit - 1})
-            if len(response.json()['blocks']) == 0:
-                break
-            for new_block in response.json()['blocks']:
-                block = Block.deserialize(new_block)
-
-                for new_move in new_block['moves']:
-                    move = session.query(Move).get(new_move['id'])
-                    if not move:
-                        move = Move.deserialize(new_move, block.id)
-                    if not move.valid:
-                        session.rollback()
-                        raise InvalidMoveError
-                    block.moves.append(move)
-                    session.add(move)
+        measurements = []
+
+        def measure(url, size, elapsed):
+            measurements.append((url, size, elapsed))
+
+        source = None
+        if hashes is not None and len(heights) > 1:
+            # Blocks are checked against the verified headers, and their
+            # moves against the root hashes in the headers, so they can be
+            # downloaded from any node which has them.
+            def check(blocks):
+                return all(
+                    hashes.get(b['id']) == b['hash'] and
+                    serialized_block_intact(b) and
+                    b['root_hash'] == cls.root_hash_of(
+                        map(serialized_move_id, b['moves'])
+                    ) and
+                    all(map(serialized_move_intact, b['moves']))
+                    for b in blocks
+                )
 
-                if not block.valid:
+            pages = fetch_block_chunks(heights, branch_point + 1, to,
+                                       check=check, measure=measure)
+        else:
+            # Every block comes from this node, so it is to blame for
+            # invalid ones.
+            source = node.url
+            pages = fetch_block_pages(
+                f"{node.url}{Node.get_blocks_endpoint}", branch_point + 1, to,
+                measure=lambda url, size, elapsed: measure(source, size,
+                                                           elapsed)
+            )
+        pool = None
+        try:
+            for new_blocks in pages:
+                if click:
+                    click.echo(f"Syncing blocks..."
+                               f"(from: {new_blocks[0]['id']})")
+                try:
+                    if hashes is not None and any(
+                        hashes.get(b['id']) != b['hash'] for b in new_blocks
+                    ):
+                        session.rollback()
+                        raise InvalidBlockError(
+                            "blocks don't match the verified headers."
+                        )
+                    if (pool is None and workers > 1 and
+                       sum(len(b['moves']) for b in new_blocks) >=
+                       POOL_MOVES):
+                        pool = multiprocessing.Pool(workers)
+                    cls.add_serialized_blocks(new_blocks, session, pool)
+                except (InvalidBlockError, InvalidMoveError):
+                    if source:
+                        measure(source, None, None)
+                    raise
+                try:
+                    session.commit()
+                except IntegrityError:
                     session.rollback()
-                    raise InvalidBlockError
-                session.add(block)
-            if len(response.json()['blocks']) < 1000:
-                break
-            from_ += limit
+                    return False
+
             try:
                 session.commit()
             except IntegrityError:
                 session.rollback()
                 return False
+            update_tip(session)
+            return True
+        except Exception:
+            # Don't let statistics below commit a half-added page.
+            session.rollback()
+            raise
+        finally:
+            pages.close()
+            if pool:
+                pool.terminate()
+                pool.join()
+            # Statistics are recorded even if the sync failed, above all
+            # when it was because of a node.
+            by_url = {n.url: n for n in nodes}
+            for url, size, elapsed in measurements:
+                if url in by_url:
+                    by_url[url].record(size is not None, elapsed, size)
+            Node.save_stats(nodes)
+
+    @classmethod
+    def fetch_headers(cls, node: Node, from_: int, to: int,
+                      timeout: float=30) -> typing.Optional[list]:
+        """Download serialized headers of blocks from ``from_`` to ``to``
+        from the given node.  It returns :const:`None` if the node doesn't
+        serve headers.
+
+        :param    node: :class:`nekoyume.models.Node` to download from.
+        :param   from_: id of the first block.
+        :param      to: id of the last block.
+        :param timeout: seconds the node is given to respond.
+        """
+        headers = []
+        while from_ <= to:
+            response = requests.get(
+                f"{node.url}{Node.get_block_headers_endpoint}",
+                params={'from': from_, 'to': to},
+                timeout=timeout
+            )
+            # Older nodes take the path for a hash of a block, and respond
+            # with no block.
+            try:
+                page = response.json()['headers']
+            except (ValueError, KeyError, TypeError):
+                return None
+            if response.status_code != 200 or not isinstance(page, list):
+                return None
+            if not page:
+                break
+            headers.extend(page)
+            from_ = page[-1]['id'] + 1
+        return headers
+
+    @classmethod
+    def locate_branch_point(cls, node: Node, tip: int, session=db.session,
+                            limit: int=500,
+                            timeout: float=30) -> typing.Optional[int]:
+        """
+        Find the id of the highest block which both this node and the
+        given node have, by sending block locators, i.e., hashes of our
+        blocks at some heights.  The first locator is spaced exponentially
+        from the tip, so a recent branch point is found in a round trip;
+        following ones are spaced evenly between the highest common block
+        and the lowest different one, until they are adjacent.  It returns
+        :const:`None` if the node doesn't answer locators.
+
+        :param    node: :class:`nekoyume.models.Node` to compare with.
+        :param     tip: id of our last block.
+        :param session: database session which has our blocks.
+        :param   limit: number of hashes a locator has at most.
+        :param timeout: seconds the node is given to respond.
+        """
+        common, heights = 0, locator_heights(tip)
+        while True:
+            hashes = dict(session.query(Block.id, Block.hash).filter(
+                Block.id.in_(heights)
+            ))
+            response = requests.post(
+                f"{node.url}{Node.post_block_locator_endpoint}",
+                json={'locator': [hashes[i] for i in sorted(heights,
+                                                            reverse=True)
+                                  if i in hashes]},
+                timeout=timeout
+            )
+            # Older nodes don't allow posting to the path for a hash of a
+            # block.
+            if response.status_code != 200:
+                return None
+            try:
+                block = response.json()['block']
+            except (ValueError, KeyError, TypeError):
+                return None
+            if block and hashes.get(block['id']) == block['hash']:
+                common = block['id']
+            different = [i for i in heights if i > common]
+            if not different or min(different) == common + 1:
+                return common
+            gap = min(different) - common - 1
+            step = -(-gap // limit)
+            heights = list(range(min(different) - 1, common, -step))
+
+    @classmethod
+    def verify_headers(cls, serialized_headers: list,
+                       session=db.session) -> typing.Dict[int, str]:
+        """
+        Check consecutive serialized headers of blocks following the blocks
+        in the database, with :meth:`valid_proof()`.  It raises
+        :exc:`nekoyume.exc.InvalidBlockError` if any of them is invalid,
+        and returns hashes of the blocks by their ids otherwise.
+
+        :param serialized_headers: headers of blocks serialized without
+                                   their moves.
+        :param            session: database session which has the blocks
+                                   before the headers.
+        """
+        window = HeaderWindow()
+        hashes = {}
+        expected = None
+        for serialized in serialized_headers:
+            block = cls.deserialize(serialized)
+            if expected is not None and block.id != expected:
+                raise InvalidBlockError(
+                    f"header of block {expected} is missing."
+                )
+            if not block.valid_proof(session, window):
+                raise InvalidBlockError(
+                    f"header of block {block.id} isn't valid."
+                )
+            window.push(block)
+            hashes[block.id] = block.hash
+            expected = block.id + 1
+        return hashes
+
+    @classmethod
+    def add_serialized_blocks(cls, serialized_blocks: list,
+                              session=db.session, pool=None) -> list:
+        """
+        Validate consecutive serialized blocks and add them to the session
+        in order.  The session is rolled back if any of them is invalid,
+        and the id of the invalid block is the last argument of the raised
+        :exc:`InvalidMoveError` or :exc:`InvalidBlockError`.
+
+        Signatures of the moves that are new to this node are verified
+        all at once by :func:`verify_moves`, in the given
+        :class:`multiprocessing.Pool` if any, while the rest of validation
+        happens here.
+
+        :param serialized_blocks: blocks serialized with their moves.
+        :param           session: database session to add blocks to.
+        :param              pool: :class:`multiprocessing.Pool` to verify
+                                  moves with.
+        """
+        window = HeaderWindow.of(session)
+        # The session may have outlived a reorg made by another one.
+        window.refresh(session)
+        serialized_moves = [m for b in serialized_blocks for m in b['moves']]
+        known = Move.get_many(map(serialized_move_id, serialized_moves),
+                              session)
+        verified = verify_moves(
+            [m for m in serialized_moves
+             if serialized_move_id(m) not in known],
+            pool
+        )
+        blocks = []
+        for new_block in serialized_blocks:
+            block = Block.deserialize(new_block)
+
+            for new_move in new_block['moves']:
+                move_id = serialized_move_id(new_move)
+                move = known.get(move_id)
+                if move:
+                    valid = move.valid
+                else:
+                    move = Move.deserialize(new_move, block.id)
+                    known[move_id] = move
+                    valid = verified[move_id]
+                if not valid:
+                    session.rollback()
+                    raise InvalidMoveError(move_id, block.id)
+                block.moves.append(move)
+                session.add(move)
+
+            if not block.valid_header_in(session):
+                session.rollback()
+                raise InvalidBlockError(block.id)
+            session.add(block)
+            # The block isn't flushed yet, so put it in the window by
+            # hand to validate the next block without a query.
+            window.push(block)
+            blocks.append(block)
+        return blocks
+
+
+class BlockHeader(typing.NamedTuple):
+    """The fields of a block needed to validate the blocks following it."""
 
+    id: int
+    hash: str
+    prev_hash: str
+    difficulty: int
+    created_at: datetime.datetime
+
+
+class HeaderWindow():
+    """
+    Headers of the last :attr:`size` blocks of the chain a session sees.
+
+    Validating a block and retargeting the difficulty only need the headers
+    of the previous block and the block 10 blocks before, so keeping the
+    last 11 headers in memory saves two queries per block.  Headers in the
+    window always make a contiguous chain; a block which doesn't chain onto
+    it, e.g., one stored by another process after a fork, replaces the whole
+    window.  Headers that aren't in the window are loaded from the database.
+    """
+
+    #: The number of headers the window keeps.
+    size = 11
+
+    def __init__(self):
+        self.headers = {}
+
+    @classmethod
+    def of(cls, session) -> 'HeaderWindow':
+        """Get the window of the given session."""
         try:
-            session.commit()
-        except IntegrityError:
-            session.rollback()
-            return False
-        return True
+            return session.info['header_window']
+        except KeyError:
+            window = session.info['header_window'] = cls()
+            return window
+
+    @property
+    def tip(self) -> typing.Optional[BlockHeader]:
+        """The header of the highest block in the window."""
+        return self.headers[max(self.headers)] if self.headers else None
+
+    def push(self, block) -> None:
+        """Put the header of the given block (or :class:`BlockHeader`)."""
+        header = BlockHeader(block.id, block.hash, block.prev_hash,
+                             block.difficulty, block.created_at)
+        if self.headers.get(header.id) == header:
+            return
+        # Headers from the height of the new one belong to another branch.
+        self.truncate(header.id - 1)
+        tip = self.tip
+        if tip and (tip.id != header.id - 1 or tip.hash != header.prev_hash):
+            self.headers.clear()
+        self.headers[header.id] = header
+        for block_id in [i for i in self.headers
+                         if i <= header.id - self.size]:
+            del self.headers[block_id]
+
+    def truncate(self, block_id: int) -> None:
+        """Forget headers of blocks higher than the given id."""
+        for i in [i for i in self.headers if i > block_id]:
+            del self.headers[i]
+
+    def clear(self) -> None:
+        self.headers.clear()
+
+    def refresh(self, session) -> None:
+        """Forget the headers if the database has another block at the
+        height of the tip, e.g., since another session reorganized the
+        chain.  Other headers needn't be checked, as they chain to the tip.
+        """
+        tip = self.tip
+        if tip and session.query(Block.hash).filter_by(
+            id=tip.id
+        ).scalar() != tip.hash:
+            self.clear()
+
+    def get(self, block_id: int, session) -> typing.Optional[BlockHeader]:
+        """Get the header of the given block id.  If it isn't in the window
+        the window is filled with the headers up to the block from the
+        database.
+        """
+        try:
+            return self.headers[block_id]
+        except KeyError:
+            pass
+        rows = session.query(
+            Block.id, Block.hash, Block.prev_hash,
+            Block.difficulty, Block.created_at
+        ).filter(
+            Block.id > block_id - self.size,
+            Block.id <= block_id,
+        ).order_by(Block.id.asc()).all()
+        if not rows or rows[-1].id != block_id:
+            return None
+        headers = [BlockHeader(*row) for row in rows]
+        tip = self.tip
+        if tip and tip.id >= block_id:
+            # Older than the window; don't let it replace the window.
+            return headers[-1]
+        for header in headers:
+            self.push(header)
+        return headers[-1]
+
+    def average_timedelta(self, block_id: int,
+                          created_at: datetime.datetime,
+                          session) -> datetime.timedelta:
+        """Average time a block took to be made for the last 10 blocks
+        before a block of the given id made at the given time.
+        """
+        check = self.get(max(1, block_id - 10), session)
+        return (created_at - check.created_at) / (block_id - check.id)
+
+
+def retarget(difficulty: int, avg_timedelta: datetime.timedelta) -> int:
+    """Difficulty of the next block of a block which has the given
+    difficulty, if recent blocks took *avg_timedelta* on average.
+    """
+    if avg_timedelta <= datetime.timedelta(0, 5):
+        return max(0, difficulty + 1)
+    elif avg_timedelta > datetime.timedelta(0, 15):
+        return max(0, difficulty - 1)
+    return difficulty
+
+
+def locator_heights(tip: int, dense: int=10) -> typing.List[int]:
+    """Heights of the blocks which a block locator from the given tip
+    consists of.  The last ``dense`` blocks are all included, and then
+    steps between them double until the first block.
+
+    >>> locator_heights(30)
+    [30, 29, 28, 27, 26, 25, 24, 23, 22, 21, 19, 15, 7, 1]
+
+    """
+    heights = []
+    height, step = tip, 1
+    while height > 1:
+        heights.append(height)
+        if len(heights) >= dense:
+            step *= 2
+        height -= step
+    heights.append(1)
+    return heights
+
+
+def fetch_block_pages(url: str, from_: int, to: int, limit: int=250,
+                      depth: int=2, latency: float=1.0,
+                      max_bytes: int=1 << 23,
+                      max_limit: int=BLOCKS_LIMIT,
+                      timeout: float=30,
+                      measure: typing.Callable[
+                          [str, typing.Optional[int], float], None
+                      ]=None) -> typing.Iterator[list]:
+    """Download serialized blocks from ``from_`` to ``to`` page by page.
+
+    A background thread prefetches pages into a queue which holds at most
+    ``depth`` pages, so the next pages are being downloaded while the
+    current one is being validated.  A page starts with ``limit`` blocks;
+    it is doubled while responses take less than ``latency`` seconds and
+    ``max_bytes`` bytes, and halved when they take more.  It stops when
+    the node has no more blocks, or fails to respond in ``timeout``
+    seconds.
+
+    :param       url: URL of the blocks endpoint of a node
+    :param     from_: id of the first block to download
+    :param        to: id of the last block to download
+    :param     limit: number of blocks of the first page
+    :param     depth: number of pages to prefetch
+    :param   latency: seconds a response is expected to take
+    :param max_bytes: bytes a response is expected to take at most
+    :param max_limit: number of blocks a page can have at most
+    :param   timeout: seconds the node is given to respond
+    :param   measure: a function called from the background thread with
+                      the URL, the bytes (:const:`None` if failed) and the
+                      seconds of each response
+    """
+    pages = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            return
+
+    def produce():
+        nonlocal from_, limit
+        try:
+            while from_ <= to and not stopped.is_set():
+                started_at = time.monotonic()
+                response = requests.get(url, params={
+                    'from': from_,
+                    'to': min(from_ + limit - 1, to),
+                }, headers={'Accept': BLOCKS_ACCEPT}, timeout=timeout)
+                elapsed = time.monotonic() - started_at
+                blocks = Block.parse_response(response)
+                if not blocks:
+                    break
+                if [b['id'] for b in blocks] != \
+                   list(range(from_, from_ + len(blocks))):
+                    raise InvalidBlockError(f'{url} served unexpected blocks.')
+                size = len(response.content)
+                if measure:
+                    measure(url, size, elapsed)
+                put(blocks)
+                from_ = blocks[-1]['id'] + 1
+                if elapsed > latency * 2 or size > max_bytes:
+                    limit = max(limit // 2, 1)
+                elif elapsed < latency and size * 2 <= max_bytes:
+                    limit = min(limit * 2, max_limit)
+        except Exception as e:
+            if measure:
+                measure(url, None, time.monotonic() - started_at)
+            put(e)
+        finally:
+            put(None)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            try:
+                page = pages.get(timeout=timeout)
+            except queue.Empty:
+                # The producer might have quit without reporting.
+                if producer.is_alive():
+                    continue
+                break
+            if page is None:
+                break
+            elif isinstance(page, Exception):
+                raise page
+            yield page
+    finally:
+        # The producer quits after its current request, if any.
+        stopped.set()
+
+
+def fetch_block_chunks(heights: typing.Dict[str, int], from_: int, to: int,
+                       check: typing.Callable[[list], bool]=None,
+                       chunk_size: int=500,
+                       timeout: float=30,
+                       measure: typing.Callable[
+                           [str, typing.Optional[int], float], None
+                       ]=None) -> typing.Iterator[list]:
+    """Download serialized blocks from ``from_`` to ``to`` in chunks from
+    several nodes at once, and yield the chunks in order.
+
+    Every node gets up to two chunks at a time among the ones it has.  A
+    chunk which failed to download, timed out, or didn't pass ``check``
+    is downloaded again from another node; if no node is left for it the
+    last error is raised.
+
+    :param    heights: heights of nodes by their URLs.
+    :param      from_: id of the first block to download.
+    :param         to: id of the last block to download.
+    :param      check: a function to check blocks of a chunk.
+    :param chunk_size: number of blocks of a chunk.
+    :param    timeout: seconds a node is given to respond.
+    :param    measure: a function called from download threads with the
+                       URL, the bytes (:const:`None` if failed) and the
+                       seconds of each response.
+    """
+    chunks = collections.deque(
+        (start, min(start + chunk_size - 1, to))
+        for start in range(from_, to + 1, chunk_size)
+    )
+    tried = collections.defaultdict(set)
+    load = collections.Counter()
+
+    def fetch(url, start, stop):
+        started_at = time.monotonic()
+        try:
+            response = requests.get(f'{url}{Node.get_blocks_endpoint}',
+                                    params={'from': start, 'to': stop},
+                                    headers={'Accept': BLOCKS_ACCEPT},
+                                    timeout=timeout)
+            blocks = Block.parse_response(response)
+            if [b['id'] for b in blocks] != list(range(start, stop + 1)) or \
+               check and not check(blocks):
+                raise InvalidBlockError(f'{url} served unexpected blocks.')
+        except Exception:
+            if measure:
+                measure(url, None, time.monotonic() - started_at)
+            raise
+        if measure:
+            measure(url, len(response.content), time.monotonic() - started_at)
+        return blocks
+
+    def submit(chunk, error=None):
+        start, stop = chunk
+        urls = [url for url, height in heights.items()
+                if height >= stop and url not in tried[chunk]]
+        if not urls:
+            raise error or InvalidBlockError(
+                f'no node has blocks {start}-{stop}.'
+            )
+        url = min(urls, key=lambda url: load[url])
+        tried[chunk].add(url)
+        load[url] += 1
+        return chunk, url, executor.submit(fetch, url, start, stop)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(heights))
+    pending = collections.deque()
+    try:
+        while chunks or pending:
+            while chunks and len(pending) < len(heights) * 2:
+                pending.append(submit(chunks.popleft()))
+            chunk, url, future = pending.popleft()
+            load[url] -= 1
+            try:
+                blocks = future.result()
+            except (requests.exceptions.RequestException, ValueError,
+                    KeyError, TypeError, InvalidBlockError) as e:
+                pending.appendleft(submit(chunk, e))
+                continue
+            yield blocks
+    finally:
+        for _, _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+@event.listens_for(Session, 'after_flush')
+def update_header_window(session, flush_context):
+    window = HeaderWindow.of(session)
+    for obj in session.deleted:
+        if isinstance(obj, Block):
+            window.truncate(obj.id - 1)
+    for obj in sorted((o for o in session.new if isinstance(o, Block)),
+                      key=lambda o: o.id):
+        window.push(obj)
+
+
+@event.listens_for(Session, 'after_rollback')
+def clear_header_window(session):
+    HeaderWindow.of(session).clear()
+
+
+@event.listens_for(Session, 'after_bulk_delete')
+def clear_header_window_after_bulk_delete(delete_context):
+    HeaderWindow.of(delete_context.session).clear()
+
+
+@event.listens_for(Session, 'after_flush')
+def mark_deleted_serializations(session, flush_context):
+    if any(isinstance(obj, (Block, Move)) for obj in session.deleted):
+        session.info['serializations_deleted'] = True
+
+
+@event.listens_for(Session, 'after_bulk_delete')
+def mark_deleted_serializations_in_bulk(delete_context):
+    delete_context.session.info['serializations_deleted'] = True
+
+
+@event.listens_for(Session, 'after_flush')
+def mark_changed_tip(session, flush_context):
+    if any(isinstance(obj, Block)
+           for obj in itertools.chain(session.new, session.deleted)):
+        session.info['tip_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_serializations(session):
+    if session.info.pop('serializations_deleted', False):
+        serializations.invalidate()
+    if session.info.pop('tip_changed', False):
+        # SQL can't be emitted here, so the tip is loaded again on demand
+        # unless it's updated by update_tip().
+        try:
+            cache.delete(TIP_CACHE_KEY)
+        except Exception:
+            pass
+        with tip_changed:
+            tip_changed.notify_all()
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_deleted_serializations(session):
+    session.info.pop('serializations_deleted', None)
+    session.info.pop('tip_changed', None)
 
 
 def get_address(public_key: PublicKey) -> str:
@@ -463,6 +1945,22 @@ def get_address(public_key: PublicKey) -> str:
     return '0x' + sha3_256(public_key.serialize(False)[1:]).hexdigest()[-40:]
 
 
+class MoveDetails(db.TypeDecorator):
+    """Details of a move, stored in a single column as a bencoded
+    dictionary of strings instead of rows of a key/value table.
+    """
+
+    impl = db.LargeBinary
+
+    def process_bind_param(self, value, dialect):
+        return bencode({k: str(v) for k, v in (value or {}).items()})
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return {}
+        return {k: v for k, v in bdecode(value).items()}
+
+
 class Move(db.Model):
     """This object contain general move information."""
     __tablename__ = 'move'
@@ -482,10 +1980,10 @@ class Move(db.Model):
     #: move name
     name = db.Column(db.String, nullable=False, index=True)
     #: move details. it contains parameters of move
-    details = association_proxy(
-        'move_details', 'value',
-        creator=lambda k, v: MoveDetail(key=k, value=v)
-    )
+    details = db.Column(MutableDict.as_mutable(MoveDetails), nullable=False)
+    #: receiver's address of the move, copied from its details to look
+    #: moves up by their receiver
+    receiver = db.Column(db.String, nullable=True, index=True)
     #: move tax (not implemented yet)
     tax = db.Column(db.BigInteger, default=0, nullable=False)
     #: move creation datetime.
@@ -510,7 +2008,10 @@ class Move(db.Model):
     }
 
     @classmethod
-    def deserialize(cls, serialized: dict, block_id=None) -> 'Move':
+    def deserialize(cls, serialized: typing.Union[dict, bytes],
+                    block_id=None) -> 'Move':
+        if isinstance(serialized, bytes):
+            return cls.decode(serialized, block_id)
         if block_id is None and serialized.get('block'):
             block_id = serialized['block'].get('id')
         return cls(
@@ -527,6 +2028,58 @@ class Move(db.Model):
             block_id=block_id,
         )
 
+    @classmethod
+    def decode(cls, encoded: bytes, block_id=None) -> 'Move':
+        """
+        Deserialize a move encoded by :meth:`encode()`.  Its id is made of
+        the received bytes instead of being received.
+
+        :param  encoded: a move encoded by :meth:`encode()`.
+        :param block_id: id of the block which has the move.
+        """
+        serialized = bdecode(encoded)
+        return cls(
+            id=h(encoded).hexdigest(),
+            user_address=serialized['user_address'],
+            name=serialized['name'],
+            user_public_key=as_bytes(serialized['user_public_key']),
+            signature=as_bytes(serialized['signature']),
+            tax=serialized['tax'],
+            details=dict(serialized['details']),
+            created_at=datetime.datetime.strptime(
+                serialized['created_at'],
+                '%Y-%m-%d %H:%M:%S.%f'),
+            block_id=block_id,
+        )
+
+    def encode(self) -> bytes:
+        """Serialize this move with its signature into the bytes its id
+        is the hash of.
+        """
+        return self.serialize(include_signature=True)
+
+    @classmethod
+    def get_many(cls, ids: typing.Iterable[str],
+                 session=db.session) -> typing.Dict[str, 'Move']:
+        """
+        Look the moves of the given ids up with as few queries as possible,
+        instead of a query per move.  It returns a :class:`dict` of the ids
+        to the moves found.
+
+        :param     ids: ids of moves to look up.
+        :param session: database session to look moves up with.
+        """
+        ids = list(set(ids))
+        found = {}
+        for i in range(0, len(ids), MOVES_QUERY_SIZE):
+            found.update(
+                (move.id, move)
+                for move in session.query(cls).filter(
+                    cls.id.in_(ids[i:i + MOVES_QUERY_SIZE])
+                )
+            )
+        return found
+
     @property
     def valid(self):
         """Check if this object is valid or not"""
@@ -539,18 +2092,24 @@ class Move(db.Model):
         assert len(self.user_public_key) == 33
         assert isinstance(self.user_address, str)
         assert re.match(r'^(?:0[xX])?[0-9a-fA-F]{40}$', self.user_address)
+        if self.id != self.hash:
+            return False
+
+        # As the id is the hash of every serialized field, the id, the
+        # signature and the public key are enough to tell if the signature
+        # was verified before.
+        key = (self.id, self.signature, self.user_public_key)
+        verified = verified_moves.get(key)
+        if verified is not None:
+            return verified
+
         public_key = PublicKey(self.user_public_key, raw=True)
         verified = public_key.ecdsa_verify(
             self.serialize(include_signature=False),
             public_key.ecdsa_deserialize(self.signature)
-        )
-        if not verified:
-            return False
-
-        if get_address(public_key) != self.user_address:
-            return False
-
-        return self.id == self.hash
+        ) and get_address(public_key) == self.user_address
+        verified_moves[key] = verified
+        return verified
 
     @property
     def confirmed(self):
@@ -570,6 +2129,13 @@ class Move(db.Model):
         :param        include_id: check if you want to include linked moves.
         :param     include_block: check if you want to include block.
         """
+        # Serialization with the block can't be memoized as the block
+        # changes on its own.
+        if use_bencode and not include_block:
+            memo = serialization_memo(self)
+            memo_key = (include_signature, include_id)
+            if memo_key in memo:
+                return memo[memo_key]
         binary = (lambda x: x) if use_bencode else bytes.hex
         serialized = dict(
             user_address=self.user_address,
@@ -592,11 +2158,15 @@ class Move(db.Model):
                 serialized['block'] = None
         if use_bencode:
             serialized = bencode(serialized)
+            if not include_block:
+                memo[memo_key] = serialized
         return serialized
 
-    def broadcast(self, sent_node=None, my_node=None, session=db.session):
+    def broadcast(self, sent_node=None, my_node=None,
+                  session=db.session) -> typing.List[BroadcastResult]:
         """
-        It broadcast this move to every nodes you know.
+        It broadcast this move to every nodes you know by
+        :meth:`Node.announce()`.
 
        :param       sent_node: sent :class:`nekoyume.models.Node`.
                                this node ignore sent node.
@@ -604,9 +2174,8 @@ class Move(db.Model):
                                received node ignore my node when they
                                broadcast received object.
         """
-        Node.broadcast(Node.post_move_endpoint,
-                       self.serialize(False, True, True),
-                       sent_node, my_node, session)
+        return Node.announce(moves=[self], sent_node=sent_node,
+                             my_node=my_node, session=session)
 
     @property
     def hash(self) -> str:
@@ -653,21 +2222,140 @@ class Move(db.Model):
             return result
 
 
-class MoveDetail(db.Model):
-    """ This object contains move's key/value information. """
+def as_bytes(value: typing.Union[str, bytes]) -> bytes:
+    """Get the bytes of a field decoded by :func:`bencode.bdecode()`, which
+    decodes bytes to :class:`str` if they're valid in UTF-8.
+    """
+    return value.encode('utf-8') if isinstance(value, str) else value
+
+
+def serialized_move_id(serialized: typing.Union[dict, bytes]) -> str:
+    """Id of a move serialized by :meth:`Move.serialize()` with its id, or
+    encoded by :meth:`Move.encode()`.
+    """
+    if isinstance(serialized, bytes):
+        return h(serialized).hexdigest()
+    return serialized['id']
+
+
+def serialized_block_intact(serialized: dict) -> bool:
+    """Whether the hash of a serialized block is made of its header, as
+    :meth:`Block.valid_proof()` makes it.
+    """
+    try:
+        block = Block.deserialize(serialized)
+        stamp = block.serialize() + block.suffix
+    except (KeyError, TypeError, ValueError):
+        return False
+    return h(stamp).hexdigest() == serialized['hash']
+
+
+def serialized_move_intact(serialized: typing.Union[dict, bytes]) -> bool:
+    """Whether the id of a serialized move is the hash of its contents.
+    Ids of encoded moves are always so, as they are made of the bytes.
+    """
+    if isinstance(serialized, bytes):
+        return True
+    try:
+        return Move.deserialize(serialized).hash == serialized['id']
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+def verify_move(serialized: typing.Union[dict, bytes]) -> bool:
+    """Check if the given serialized move is valid.  This is what
+    :func:`verify_moves` runs in worker processes.
+    """
+    try:
+        return Move.deserialize(serialized).valid
+    except (AssertionError, BencodeDecodeError, KeyError, TypeError,
+            ValueError):
+        return False
+
+
+def verify_moves(serialized_moves: list,
+                 pool=None) -> typing.Dict[str, bool]:
+    """
+    Check signatures and hashes of the given serialized moves.  It returns
+    a :class:`dict` of the move ids to their validity.
+
+    :param serialized_moves: moves serialized with their signatures and
+                             ids, or encoded by :meth:`Move.encode()`.
+    :param             pool: :class:`multiprocessing.Pool` to verify moves
+                             with.  If it's omitted moves are verified in
+                             this process.
+    """
+    if pool is None or len(serialized_moves) < 2:
+        results = map(verify_move, serialized_moves)
+    else:
+        results = pool.map(verify_move, serialized_moves)
+    verified = {}
+    for serialized, valid in zip(serialized_moves, results):
+        move_id = serialized_move_id(serialized)
+        # The same id must not be both valid and invalid.
+        verified[move_id] = verified.get(move_id, True) and valid
+        if valid and pool is not None:
+            # Let this process know what its workers verified.
+            if isinstance(serialized, bytes):
+                serialized = bdecode(serialized)
+            verified_moves[(
+                move_id,
+                as_bytes(serialized['signature']),
+                as_bytes(serialized['user_public_key']),
+            )] = True
+    return verified
+
+
+@event.listens_for(Move, 'init', propagate=True)
+def init_move_details(target, args, kwargs):
+    kwargs.setdefault('details', {})
+
+
+@event.listens_for(Move.details, 'set', propagate=True)
+def set_move_receiver(target, value, oldvalue, initiator):
+    target.receiver = (value or {}).get('receiver')
+
+
+@event.listens_for(Move.details, 'modified', propagate=True)
+def update_move_receiver(target, initiator):
+    target.receiver = target.details.get('receiver')
+
+
+def serialization_memo(obj) -> dict:
+    """Get the :class:`dict` which memoizes bencoded serializations of the
+    given :class:`Block` or :class:`Move`.
+    """
+    return obj.__dict__.setdefault('_serialization_memo', {})
+
+
+def forget_serialization(obj) -> None:
+    """Forget memoized serializations of the given :class:`Block` or
+    :class:`Move`.
+    """
+    if obj is not None:
+        obj.__dict__.pop('_serialization_memo', None)
+
 
-    #: move id
-    move_id = db.Column(db.String,  db.ForeignKey('move.id'),
-                        nullable=True, primary_key=True)
-    move = db.relationship(Move, backref=db.backref(
-        'move_details',
-        collection_class=attribute_mapped_collection("key"),
-        cascade="all, delete-orphan"
-    ))
-    #: MoveDetail's key
-    key = db.Column(db.String, nullable=False, primary_key=True)
-    #: MoveDetail's value
-    value = db.Column(db.String, nullable=False, index=True)
+def forget_serialization_on_set(target, value, oldvalue, initiator):
+    forget_serialization(target)
+
+
+def forget_serialization_on_modified(target, initiator):
+    forget_serialization(target)
+
+
+def forget_serialization_on_expire(target, *args):
+    forget_serialization(target)
+
+
+for cls in (Block, Move):
+    for column in inspect(cls).column_attrs:
+        event.listen(getattr(cls, column.key), 'set',
+                     forget_serialization_on_set, propagate=True)
+    event.listen(cls, 'expire', forget_serialization_on_expire,
+                 propagate=True)
+event.listen(Move.details, 'modified', forget_serialization_on_modified,
+             propagate=True)
 
 
 class HackAndSlash(Move):
@@ -1137,15 +2825,26 @@ class User():
                                           'item2': item2,
                                           'item3': item3}))
 
-    def create_block(self, moves, commit=True, click=None):
-        """ Create a block. """
+    def create_block(self, moves, commit=True, click=None, workers=1,
+                     cancel=None):
+        """
+        Create a block.
+
+        Mining is given up and ``None`` is returned as soon as another block
+        of the same height is stored, or *cancel* returns ``True``.
+
+        :params   moves: moves to include in the block
+        :params  commit: commit in this function automatically or not
+        :params   click: click module to print mining progress
+        :params workers: number of processes to mine the block with
+        :params  cancel: function called during mining to check if mining
+                         should be given up
+        """
         for move in moves:
             if not move.valid:
                 raise InvalidMoveError(move)
         block = Block(version=PROTOCOL_VERSION)
-        block.root_hash = h(
-            ''.join(sorted((m.id for m in moves))).encode('utf-8')
-        ).hexdigest()
+        block.root_hash = Block.root_hash_of(m.id for m in moves)
         block.creator = self.address
         block.created_at = datetime.datetime.utcnow()
 
@@ -1155,30 +2854,42 @@ class User():
         if prev_block:
             block.id = prev_block.id + 1
             block.prev_hash = prev_block.hash
-            block.difficulty = prev_block.difficulty
-            difficulty_check_block = self.session.query(Block).get(
-                max(1, block.id - 10)
-            )
-            avg_timedelta = (
-                (block.created_at - difficulty_check_block.created_at) /
-                (block.id - difficulty_check_block.id)
+            window = HeaderWindow.of(self.session)
+            window.push(prev_block)
+            avg_timedelta = window.average_timedelta(
+                block.id, block.created_at, self.session
             )
             if click:
-                click.echo(
-                    f'avg: {avg_timedelta}, difficulty: {block.difficulty}'
-                )
-            if avg_timedelta <= datetime.timedelta(0, 5):
-                block.difficulty = max(0, block.difficulty + 1)
-            elif avg_timedelta > datetime.timedelta(0, 15):
-                block.difficulty = max(0, block.difficulty - 1)
+                click.echo(f'avg: {avg_timedelta}, '
+                           f'difficulty: {prev_block.difficulty}')
+            block.difficulty = retarget(prev_block.difficulty, avg_timedelta)
         else:
             #: Genesis block
             block.id = 1
             block.prev_hash = None
             block.difficulty = 0
 
-        block.suffix = hashcash._mint(block.serialize(), bits=block.difficulty)
-        if self.session.query(Block).get(block.id):
+        if click:
+            def progress(p: hashcash.MintProgress):
+                click.echo(f'hashes: {p.hashes}, '
+                           f'hashrate: {p.hashrate:.0f} H/s, '
+                           f'eta: {p.eta:.1f}s')
+        else:
+            progress = None
+
+        def stale():
+            if cancel and cancel():
+                return True
+            return self.session.query(Block.id).filter_by(
+                id=block.id
+            ).first() is not None
+
+        block.suffix = hashcash._mint(block.serialize(),
+                                      bits=block.difficulty,
+                                      workers=workers,
+                                      progress=progress,
+                                      cancel=stale)
+        if block.suffix is None or self.session.query(Block).get(block.id):
             return None
         block.hash = h(block.serialize() + block.suffix).hexdigest()
 
@@ -1191,6 +2902,7 @@ class User():
         if commit:
             self.session.add(block)
             self.session.commit()
+            update_tip(self.session)
 
         return block
 
@@ -1232,9 +2944,7 @@ class Avatar():
         if not create_move or block_id < create_move.block_id:
             return None
         moves = session.query(Move).filter(
-            or_(Move.user_address == user_addr, Move.id.in_(
-                    db.session.query(MoveDetail.move_id).filter_by(
-                        key='receiver', value=user_addr)))
+            or_(Move.user_address == user_addr, Move.receiver == user_addr)
         ).filter(
             Move.block_id >= create_move.block_id,
             Move.block_id <= block_id
@@ -1247,8 +2957,7 @@ class Avatar():
         for move in moves:
             if move.user_address == user_addr:
                 avatar, result = move.execute(avatar)
-            if (type(move) == Send and
-               move.details['receiver'] == user_addr):
+            if type(move) == Send and move.receiver == user_addr:
                 avatar, result = move.receive(avatar)
 
         return avatar
@@ -1362,3 +3071,62 @@ class Novice(Avatar):
     @property
     def max_hp(self):
         return self.constitution + 6
+
+
+def migrate(session=db.session, click=None) -> None:
+    """Migrate the database to the current schema.
+
+    It creates missing tables, adds missing columns (and their indexes) to
+    existing tables, and moves details of moves out of the ``move_detail``
+    table which older versions had kept them in.
+
+    :param session: Database session to migrate
+    :param   click: :mod:`click` to echo progress with
+    """
+    connection = session.connection()
+    quote = connection.dialect.identifier_preparer.quote
+    table_names = inspect(connection).get_table_names()
+    for table in db.metadata.sorted_tables:
+        if table.name not in table_names:
+            table.create(connection)
+            if click:
+                click.echo(f'Table {table.name} was created.')
+            continue
+        existing = {
+            column['name']
+            for column in inspect(connection).get_columns(table.name)
+        }
+        added = [c for c in table.columns if c.name not in existing]
+        for column in added:
+            definition = column.type.compile(connection.dialect)
+            if column.server_default is not None:
+                definition += f" DEFAULT '{column.server_default.arg}'"
+                if not column.nullable:
+                    definition += ' NOT NULL'
+            connection.execute(
+                f'ALTER TABLE {quote(table.name)} '
+                f'ADD COLUMN {quote(column.name)} {definition}'
+            )
+            if click:
+                click.echo(f'Column {table.name}.{column.name} was added.')
+        for index in table.indexes:
+            if any(column in added for column in index.columns):
+                index.create(connection)
+    if 'move_detail' in table_names:
+        rows = connection.execute(
+            'SELECT move_id, key, value FROM move_detail ORDER BY move_id'
+        ).fetchall()
+        move = Move.__table__
+        migrated = 0
+        for move_id, group in itertools.groupby(rows, lambda row: row[0]):
+            details = {key: value for _, key, value in group}
+            connection.execute(
+                move.update().where(move.c.id == move_id).values(
+                    details=details, receiver=details.get('receiver')
+                )
+            )
+            migrated += 1
+        connection.execute('DROP TABLE move_detail')
+        if click:
+            click.echo(f'Details of {migrated} moves were migrated.')
+    session.commit()
@@ -1,24 +1,134 @@
-from celery import Celery
+import collections
+import os
+import threading
+import time
+import typing
+
+from flask import current_app
 
 from nekoyume.models import Block, db, Move, Node
 
 
-celery = Celery()
+class RelayQueue():
+    """Relays moves and blocks to other nodes from a background thread of
+    this process, so web requests don't wait for it.
+
+    Pending relays are deduplicated by their ids, and the ones queued while
+    others are being sent (or within ``linger`` seconds) are announced
+    together by :meth:`Node.announce()`.  As the thread is a daemon,
+    relays still pending when the process exits are lost.
+    """
+
+    def __init__(self, linger: float=0.1):
+        #: seconds to wait for more relays before announcing them
+        self.linger = linger
+        self.pending = collections.OrderedDict()
+        self.sending = False
+        self.condition = threading.Condition()
+        self.pid = None
+
+    def relay_move(self, move_id: str, sent_node_url: str=None,
+                   my_node_url: str=None):
+        """Queue a move to relay to the other nodes.
+
+        :param       move_id: id of the move to relay.
+        :param sent_node_url: URL of the node which sent the move, if any.
+        :param   my_node_url: URL of this node.
+        """
+        self.put('moves', move_id, sent_node_url, my_node_url)
+
+    def relay_block(self, block_id: int, sent_node_url: str=None,
+                    my_node_url: str=None):
+        """Queue a block to relay to the other nodes.
+
+        :param      block_id: id of the block to relay.
+        :param sent_node_url: URL of the node which sent the block, if any.
+        :param   my_node_url: URL of this node.
+        """
+        self.put('blocks', block_id, sent_node_url, my_node_url)
+
+    def put(self, kind: str, id_, sent_node_url: typing.Optional[str],
+            my_node_url: typing.Optional[str]):
+        # Objects are looked up in the database of the app which queued
+        # them, when they are sent.
+        app = current_app._get_current_object()
+        with self.condition:
+            self.pending.setdefault((app, kind, id_),
+                                    (sent_node_url, my_node_url))
+            self.condition.notify_all()
+            # A forked process doesn't have the thread of its parent.
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                threading.Thread(target=self.run, daemon=True).start()
+
+    def join(self, timeout: float=None) -> bool:
+        """Wait until every queued relay is sent.  It returns
+        :const:`False` on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while self.pending or self.sending:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                self.condition.wait(remaining)
+        return True
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                self.sending = True
+            time.sleep(self.linger)
+            with self.condition:
+                pending, self.pending = self.pending, collections.OrderedDict()
+            try:
+                self.send(pending)
+            finally:
+                with self.condition:
+                    self.sending = False
+                    self.condition.notify_all()
 
+    def send(self, pending: typing.Dict[tuple, tuple]):
+        groups = collections.OrderedDict()
+        for (app, kind, id_), (sent_node_url, my_node_url) in pending.items():
+            group = groups.setdefault((app, sent_node_url, my_node_url),
+                                      {'moves': [], 'blocks': []})
+            group[kind].append(id_)
+        for (app, sent_node_url, my_node_url), ids in groups.items():
+            with app.app_context():
+                try:
+                    self.announce(ids['moves'], ids['blocks'],
+                                  sent_node_url, my_node_url)
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception('Failed to relay %r.', ids)
 
-@celery.task()
-def move_broadcast(move_id, sent_node_url, my_node_url, session=db.session):
-    try:
-        session.query(Move).get(move_id).broadcast(Node(url=sent_node_url),
-                                                   Node(url=my_node_url))
-    except AttributeError:
-        pass
+    def announce(self, move_ids: typing.List[str], block_ids: typing.List[int],
+                 sent_node_url: typing.Optional[str],
+                 my_node_url: typing.Optional[str]):
+        moves = list(Move.get_many(move_ids).values())
+        blocks = Block.query.filter(Block.id.in_(block_ids)).order_by(
+            Block.id
+        ).all() if block_ids else []
+        if not moves and not blocks:
+            return
+        # Nodes take only consecutive blocks at once.
+        runs = []
+        for block in blocks:
+            if runs and runs[-1][-1].id + 1 == block.id:
+                runs[-1].append(block)
+            else:
+                runs.append([block])
+        for i, run in enumerate(runs or [[]]):
+            Node.announce(moves=moves if i == 0 else (), blocks=run,
+                          sent_node=Node(url=sent_node_url),
+                          my_node=Node(url=my_node_url) if my_node_url
+                          else None)
 
 
-@celery.task()
-def block_broadcast(block_id, sent_node_url, my_node_url, session=db.session):
-    try:
-        session.query(Block).get(block_id).broadcast(Node(url=sent_node_url),
-                                                     Node(url=my_node_url))
-    except AttributeError:
-        pass
+#: The queue web requests relay moves and blocks through.
+relay_queue = RelayQueue()
@@ -17,7 +17,6 @@ def long_description():
 install_requires = [
     'bencode.py >= 2.0.0, < 2.1.0',
     'blinker >= 1.4, < 1.5',
-    'celery >= 4.1.0, < 4.2.0',
     'click >= 6.7, < 7.0',
     'cykeccak >= 0.13.2.2, < 0.14.0.0',
     'Flask >= 0.12.2, < 0.13.0',
@@ -1,3 +1,13 @@
+import gzip
+from hashlib import sha256 as h
+import json
+
+from bencode import bdecode, bencode
+import requests
+
+from nekoyume.models import Block, Move, Node, cache, db
+
+
 def test_get_blocks(fx_test_client, fx_user):
     move = fx_user.sleep()
 
@@ -24,3 +34,353 @@ def test_get_blocks(fx_test_client, fx_user):
     rv = fx_test_client.get(f'/blocks/last')
     assert rv.status == '200 OK'
     assert block.hash.encode() in rv.data
+
+
+def test_get_block_headers(fx_test_client, fx_user):
+    blocks = [fx_user.create_block([fx_user.sleep()]) for _ in range(3)]
+
+    rv = fx_test_client.get('/blocks/headers')
+    assert rv.status == '200 OK'
+    headers = json.loads(rv.get_data(as_text=True))['headers']
+    assert [h['hash'] for h in headers] == [b.hash for b in blocks]
+    assert all('moves' not in h and 'suffix' in h for h in headers)
+
+    rv = fx_test_client.get('/blocks/headers?from=2&to=2')
+    assert rv.status == '200 OK'
+    headers = json.loads(rv.get_data(as_text=True))['headers']
+    assert [h['id'] for h in headers] == [2]
+
+
+def test_post_block_locator(fx_test_client, fx_user):
+    blocks = [fx_user.create_block([]) for _ in range(3)]
+
+    def post(locator):
+        rv = fx_test_client.post('/blocks/locator',
+                                 data=json.dumps({'locator': locator}),
+                                 content_type='application/json')
+        return rv.status, json.loads(rv.get_data(as_text=True))
+
+    status, data = post(['f' * 64, blocks[1].hash, blocks[0].hash])
+    assert status == '200 OK'
+    assert data['block']['hash'] == blocks[1].hash
+    assert 'moves' not in data['block']
+
+    status, data = post(['f' * 64])
+    assert status == '200 OK'
+    assert data['block'] is None
+
+    status, _ = post('f' * 64)
+    assert status == '400 BAD REQUEST'
+
+
+def test_get_blocks_in_bencode(fx_test_client, fx_user):
+    move = fx_user.sleep()
+    block = fx_user.create_block([move])
+
+    rv = fx_test_client.get('/blocks', headers={
+        'Accept': 'application/x-bencode, application/json;q=0.9',
+    })
+    assert rv.status == '200 OK'
+    assert rv.mimetype == 'application/x-bencode'
+    [encoded] = bdecode(rv.get_data())['blocks']
+    decoded = Block.decode(encoded)
+    assert decoded['hash'] == block.hash
+    assert decoded['suffix'] == block.suffix
+    assert decoded['moves'] == [move.serialize(include_signature=True)]
+
+    rv = fx_test_client.get('/blocks', headers={'Accept': '*/*'})
+    assert rv.mimetype == 'application/json'
+
+
+def test_get_blocks_cacheable(fx_test_client, fx_user, monkeypatch):
+    blocks = [fx_user.create_block([]) for _ in range(2)]
+
+    rv = fx_test_client.get('/blocks', headers={'Accept-Encoding': 'gzip'})
+    assert rv.status == '200 OK'
+    assert rv.headers['Content-Encoding'] == 'gzip'
+    assert blocks[1].hash.encode() in gzip.decompress(rv.get_data())
+    assert 'no-cache' in rv.headers['Cache-Control']
+    assert set(rv.vary) == {'Accept', 'Accept-Encoding'}
+    etag, _ = rv.get_etag()
+
+    rv = fx_test_client.get('/blocks', headers={'Accept-Encoding': 'gzip',
+                                                'If-None-Match': f'"{etag}"'})
+    assert rv.status == '304 NOT MODIFIED'
+    assert rv.get_data() == b''
+
+    # Representations without gzip or in another type have other tags.
+    rv = fx_test_client.get('/blocks', headers={'If-None-Match': f'"{etag}"'})
+    assert rv.status == '200 OK'
+    assert 'Content-Encoding' not in rv.headers
+    identity_etag, _ = rv.get_etag()
+    assert identity_etag != etag
+    rv = fx_test_client.get('/blocks', headers={
+        'Accept': 'application/x-bencode',
+    })
+    assert rv.get_etag()[0] not in (etag, identity_etag)
+
+    # A new block changes the tag of a range up to the last block.
+    fx_user.create_block([])
+    rv = fx_test_client.get('/blocks',
+                            headers={'If-None-Match': f'"{identity_etag}"'})
+    assert rv.status == '200 OK'
+
+    monkeypatch.setattr('nekoyume.api.STABLE_DEPTH', 2)
+    rv = fx_test_client.get(f'/blocks/{blocks[0].id}')
+    assert rv.status == '200 OK'
+    assert rv.cache_control.max_age == 60 * 60 * 24
+    rv = fx_test_client.get(f'/blocks/{blocks[0].hash}', headers={
+        'If-None-Match': rv.headers['ETag'],
+    })
+    assert rv.status == '304 NOT MODIFIED'
+
+
+def test_get_blocks_streaming(fx_test_client, fx_user, monkeypatch):
+    monkeypatch.setattr('nekoyume.api.BLOCKS_LIMIT', 3)
+    monkeypatch.setattr('nekoyume.api.BLOCKS_BATCH_SIZE', 2)
+    moves = [fx_user.sleep() for _ in range(4)]
+    blocks = [fx_user.create_block([move]) for move in moves]
+
+    rv = fx_test_client.get('/blocks?from=2')
+    assert rv.is_streamed
+    served = json.loads(rv.get_data(as_text=True))['blocks']
+    assert [b['hash'] for b in served] == [b.hash for b in blocks[1:]]
+    assert [b['moves'][0]['id'] for b in served] == \
+        [m.id for m in moves[1:]]
+
+    rv = fx_test_client.get('/blocks', headers={
+        'Accept': 'application/x-bencode',
+        'Accept-Encoding': 'gzip',
+    })
+    served = bdecode(gzip.decompress(rv.get_data()))['blocks']
+    assert [Block.decode(b)['hash'] for b in served] == \
+        [b.hash for b in blocks[:3]]
+
+
+def test_get_moves_cached(fx_test_client, fx_user):
+    move = fx_user.sleep()
+    rv = fx_test_client.get(f'/moves/{move.id}')
+    assert json.loads(rv.get_data(as_text=True))['move']['block'] is None
+
+    block = fx_user.create_block([move])
+    for _ in range(2):
+        rv = fx_test_client.get(f'/moves/{move.id}')
+        served = json.loads(rv.get_data(as_text=True))['move']
+        assert served['block']['id'] == block.id
+
+    rv = fx_test_client.get(f'/blocks/{block.id}')
+    assert block.hash.encode() in rv.data
+    fx_user.session.delete(block)
+    fx_user.session.commit()
+    rv = fx_test_client.get(f'/blocks/{block.id}')
+    assert json.loads(rv.get_data(as_text=True))['block'] is None
+
+
+def test_get_last_block_cached(fx_app, fx_test_client, fx_user, monkeypatch):
+    cache.init_app(fx_app, config={'CACHE_TYPE': 'simple'})
+    rv = fx_test_client.get('/blocks/last')
+    assert json.loads(rv.get_data(as_text=True))['block'] is None
+
+    block = fx_user.create_block([])
+    rv = fx_test_client.get('/blocks/last')
+    assert json.loads(rv.get_data(as_text=True))['block']['hash'] == \
+        block.hash
+    etag = rv.headers['ETag']
+
+    def query(*args, **kwargs):
+        raise AssertionError('the tip has to be cached')
+
+    monkeypatch.setattr(db.session, 'query', query)
+    rv = fx_test_client.get('/blocks/last', headers={'If-None-Match': etag})
+    assert rv.status == '304 NOT MODIFIED'
+    monkeypatch.undo()
+
+    # Commits which don't update the tip still invalidate it.
+    fx_user.session.delete(block)
+    fx_user.session.commit()
+    rv = fx_test_client.get('/blocks/last', headers={'If-None-Match': etag})
+    assert rv.status == '200 OK'
+    assert json.loads(rv.get_data(as_text=True))['block'] is None
+
+
+def test_wait_block(fx_test_client, fx_user):
+    rv = fx_test_client.get('/blocks/wait?timeout=0.1')
+    assert rv.status == '204 NO CONTENT'
+
+    block = fx_user.create_block([fx_user.sleep()])
+    rv = fx_test_client.get('/blocks/wait?timeout=0.1')
+    assert rv.status == '200 OK'
+    served = json.loads(rv.get_data(as_text=True))['block']
+    assert served['hash'] == block.hash
+    assert 'moves' not in served
+
+    rv = fx_test_client.get(f'/blocks/wait?after={block.hash}&timeout=0.1')
+    assert rv.status == '204 NO CONTENT'
+
+    for timeout in ('nan', 'inf', '-1'):
+        rv = fx_test_client.get(f'/blocks/wait?timeout={timeout}')
+        assert rv.status == '400 BAD REQUEST'
+
+
+def test_post_inventory(fx_test_client, fx_user):
+    move = fx_user.sleep()
+    block = fx_user.create_block([move])
+    rv = fx_test_client.post('/inventory', data=json.dumps({
+        'moves': [move.id, 'a' * 64, 'a' * 64],
+        'blocks': [{'id': block.id, 'hash': block.hash},
+                   {'id': block.id + 1, 'hash': 'b' * 64}],
+    }), content_type='application/json')
+    assert json.loads(rv.get_data(as_text=True)) == {
+        'moves': ['a' * 64],
+        'blocks': ['b' * 64],
+    }
+
+    rv = fx_test_client.post('/inventory', data=json.dumps({
+        'blocks': [{'id': 1}],
+    }), content_type='application/json')
+    assert rv.status_code == 400
+
+
+def test_post_in_bencode(fx_session, fx_other_user, fx_other_session,
+                         fx_server, fx_novice_status):
+    headers = {'Content-Type': 'application/x-bencode'}
+    move = fx_other_user.create_novice(fx_novice_status)
+    requests.post(f'{fx_server.url}{Node.post_move_endpoint}',
+                  data=bencode({'move': move.encode()}), headers=headers)
+    assert fx_session.query(Move).get(move.id)
+
+    move = fx_other_user.level_up('strength')
+    block = fx_other_user.create_block([move])
+    requests.post(f'{fx_server.url}{Node.post_block_endpoint}',
+                  data=bencode({'block': block.encode()}), headers=headers)
+    assert fx_session.query(Block).get(block.id).hash == block.hash
+    assert fx_session.query(Move).get(move.id).block_id == block.id
+
+    response = requests.post(f'{fx_server.url}{Node.post_move_endpoint}',
+                             data=b'garbage', headers=headers)
+    assert response.status_code == 400
+    response = requests.post(f'{fx_server.url}{Node.post_move_endpoint}',
+                             json=[move.id])
+    assert response.status_code == 400
+
+
+def test_post_malformed_blocks(fx_session, fx_other_user, fx_server):
+    headers = {'Content-Type': 'application/x-bencode'}
+    block = fx_other_user.create_block([])
+    malformed = dict(block.encode(), header=bencode('abc'))
+    for endpoint, body in ((Node.post_block_endpoint, {'block': malformed}),
+                           (Node.post_blocks_batch_endpoint,
+                            {'blocks': [malformed]})):
+        response = requests.post(f'{fx_server.url}{endpoint}',
+                                 data=bencode(body), headers=headers)
+        assert response.status_code == 400
+
+    header = bdecode(block.serialize())
+    without_id = {k: v for k, v in header.items() if k != 'id'}
+    for invalid in (without_id, dict(header, id='1'),
+                    dict(header, prev_hash=1)):
+        body = {'block': dict(block.encode(), header=bencode(invalid))}
+        response = requests.post(f'{fx_server.url}{Node.post_block_endpoint}',
+                                 data=bencode(body), headers=headers)
+        assert response.status_code == 400
+
+    serialized = block.serialize(use_bencode=False, include_suffix=True,
+                                 include_moves=True, include_hash=True)
+    response = requests.post(f'{fx_server.url}{Node.post_block_endpoint}',
+                             json=dict(serialized, created_at='yesterday'))
+    assert response.status_code == 400
+    response = requests.post(f'{fx_server.url}{Node.post_block_endpoint}',
+                             json=[serialized])
+    assert response.status_code == 400
+    without_moves = {k: v for k, v in serialized.items() if k != 'moves'}
+    for invalid in (without_moves, dict(serialized, moves=None)):
+        response = requests.post(
+            f'{fx_server.url}{Node.post_block_endpoint}', json=invalid
+        )
+        assert response.status_code == 400
+    assert not fx_session.query(Block).count()
+
+
+def test_post_moves_batch(fx_session, fx_other_user, fx_other_session,
+                          fx_server, fx_novice_status, fx_relayed):
+    url = f'{fx_server.url}{Node.post_moves_batch_endpoint}'
+    known = fx_other_user.create_novice(fx_novice_status)
+    requests.post(url, json={'moves': [known.serialize(
+        use_bencode=False, include_signature=True, include_id=True
+    )]})
+    assert fx_relayed == [known.id]
+
+    new = fx_other_user.level_up('strength')
+    invalid = fx_other_user.sleep()
+    invalid.details['foo'] = 'bar'
+    response = requests.post(
+        url,
+        data=bencode({'moves': [m.encode() for m in (known, new, invalid)]}),
+        headers={'Content-Type': 'application/x-bencode'},
+    )
+    assert response.json()['results'] == [
+        {'id': known.id, 'result': 'known'},
+        {'id': new.id, 'result': 'success'},
+        {'id': h(invalid.encode()).hexdigest(), 'result': 'failed',
+         'message': f"move {h(invalid.encode()).hexdigest()} isn't valid."},
+    ]
+    assert fx_relayed == [known.id, new.id]
+    assert fx_session.query(Move).count() == 2
+
+    for body in ({'moves': []}, [known.id], {'moves': known.id}):
+        response = requests.post(url, json=body)
+        assert response.status_code == 400
+
+    for id_ in (['x'], 1, None):
+        response = requests.post(url, json={'moves': [dict(
+            new.serialize(use_bencode=False, include_signature=True,
+                          include_id=True),
+            id=id_
+        )]})
+        assert response.status_code == 400
+
+
+def test_post_blocks_batch(fx_user, fx_session, fx_server, fx_novice_status,
+                           fx_relayed):
+    url = f'{fx_server.url}{Node.post_blocks_batch_endpoint}'
+    blocks = [fx_user.create_block([fx_user.create_novice(fx_novice_status)])]
+    blocks += [fx_user.create_block([fx_user.sleep()]) for _ in range(3)]
+    serialized = [
+        b.serialize(use_bencode=False, include_suffix=True,
+                    include_moves=True, include_hash=True)
+        for b in blocks
+    ]
+    encoded = [b.encode() for b in blocks]
+    encoded[-1]['header'] = encoded[-1]['header'].replace(
+        blocks[-1].root_hash.encode(), b'0' * 64
+    )
+    fx_session.query(Move).delete()
+    fx_session.query(Block).delete()
+    fx_session.commit()
+
+    requests.post(url, json={'blocks': serialized[:1]})
+    assert fx_relayed == [1]
+
+    response = requests.post(
+        url, data=bencode({'blocks': encoded}),
+        headers={'Content-Type': 'application/x-bencode'},
+    )
+    results = response.json()['results']
+    assert [r['result'] for r in results] == [
+        'known', 'success', 'success', 'failed'
+    ]
+    assert [r['id'] for r in results] == [1, 2, 3, 4]
+    assert fx_relayed == [1, 2, 3]
+    assert fx_session.query(Block).count() == 3
+    assert fx_session.query(Move).count() == 3
+
+    for body in ({'blocks': serialized[::2]}, serialized[1:],
+                 {'blocks': serialized[1]}):
+        response = requests.post(url, json=body)
+        assert response.status_code == 400
+
+    for id_ in ('2', 2.0, None, [2]):
+        response = requests.post(
+            url, json={'blocks': [dict(serialized[1], id=id_)]}
+        )
+        assert response.status_code == 400
@@ -4,9 +4,11 @@ import pytest
 from pytest_localserver.http import WSGIServer
 from secp256k1 import PrivateKey
 from sqlalchemy.orm import sessionmaker
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+from werkzeug.wrappers import Response
 
 from nekoyume.app import create_app
-from nekoyume.models import db, User
+from nekoyume.models import db, serializations, User
 
 
 @pytest.fixture
@@ -18,7 +20,6 @@ def fx_app():
     app.config['SQLALCHEMY_BINDS'] = {
         'other_test': 'sqlite:///other_test.db?check_same_thread=false'
     }
-    app.config['CELERY_ALWAYS_EAGER'] = True
     app.app_context().push()
     return app
 
@@ -31,6 +32,7 @@ def fx_session(fx_app):
     fx_db.drop_all()
     fx_db.session.commit()
     fx_db.create_all()
+    serializations.invalidate()
     return fx_db.session
 
 
@@ -54,6 +56,33 @@ def fx_server(request, fx_app):
     return server
 
 
+@pytest.fixture
+def fx_legacy_server(request, fx_app):
+    """A server which responds to endpoints added since protocol version 1
+    the way nodes of that version did.
+    """
+    def legacy_app(environ, start_response):
+        path, method = environ['PATH_INFO'], environ['REQUEST_METHOD']
+        if path in ('/blocks/headers', '/blocks/wait', '/blocks/locator'):
+            # These are taken by the path for a hash of a block, which
+            # allows only GET.
+            if method != 'GET':
+                return MethodNotAllowed(['GET'])(environ, start_response)
+            response = Response('{"block": null}\n',
+                                mimetype='application/json')
+            return response(environ, start_response)
+        elif path in ('/inventory', '/moves/batch', '/blocks/batch'):
+            return NotFound()(environ, start_response)
+        # Blocks were always responded in JSON.
+        environ['HTTP_ACCEPT'] = 'application/json'
+        return fx_app.wsgi_app(environ, start_response)
+
+    server = WSGIServer(application=legacy_app)
+    server.start()
+    request.addfinalizer(server.stop)
+    return server
+
+
 @pytest.fixture
 def fx_test_client(fx_app):
     fx_app.testing = True
@@ -89,6 +118,32 @@ def fx_other_session(fx_app, fx_other_app):
     return session
 
 
+@pytest.fixture
+def fx_other_user(fx_other_session):
+    user = User(PrivateKey())
+    user.session = fx_other_session
+    return user
+
+
+class Relayed(list):
+
+    def relay_move(self, move_id, **kwargs):
+        self.append(move_id)
+
+    def relay_block(self, block_id, **kwargs):
+        self.append(block_id)
+
+
+@pytest.fixture
+def fx_relayed(monkeypatch):
+    """Ids of moves and blocks the web app relays, instead of relaying
+    them to other nodes.
+    """
+    relayed = Relayed()
+    monkeypatch.setattr('nekoyume.api.relay_queue', relayed)
+    return relayed
+
+
 @pytest.fixture
 def fx_novice_status():
     return {
@@ -1,9 +1,10 @@
 import hashlib
 import os
+import sys
 
 from pytest import mark
 
-from nekoyume.hashcash import check, has_leading_zero_bits, _mint
+from nekoyume.hashcash import benchmark, check, has_leading_zero_bits, _mint
 
 
 @mark.parametrize('challenge', [os.urandom(40) for _ in range(5)])
@@ -31,3 +32,65 @@ def test_has_leading_zero_bits():
     assert f(b'\0\x7f', 9)
     assert not f(b'\0\x7f', 10)
     assert f(b'\0?', 10)
+
+
+@mark.parametrize('bits', [0, 8, 20])
+def test_mint_parallel(bits):
+    challenge = os.urandom(40)
+    answer = _mint(challenge, bits, workers=4)
+    assert check(challenge + answer, bits=bits)
+    assert answer == _mint(challenge, bits)
+
+
+def _reference_mint(challenge: bytes, bits: int) -> bytes:
+    counter = 1
+    while True:
+        answer = counter.to_bytes((counter.bit_length() + 7) // 8,
+                                  sys.byteorder)
+        if has_leading_zero_bits(hashlib.sha256(challenge + answer).digest(),
+                                 bits):
+            return answer
+        counter += 1
+
+
+@mark.parametrize('challenge', [os.urandom(300) for _ in range(3)])
+@mark.parametrize('bits', [0, 1, 7, 8, 9, 12, 16])
+def test_mint_matches_reference(challenge, bits):
+    assert _mint(challenge, bits) == _reference_mint(challenge, bits)
+
+
+def test_mint_progress():
+    reports = []
+    # It takes several batches to answer this challenge.
+    challenge = b'challenge0'
+    answer = _mint(challenge, 16, progress=reports.append, interval=0)
+    assert check(challenge + answer, bits=16)
+    assert reports
+    assert all(p.bits == 16 for p in reports)
+    assert [p.hashes for p in reports] == sorted(p.hashes for p in reports)
+    assert reports[-1].hashes < int.from_bytes(answer, sys.byteorder)
+    assert reports[-1].expected_hashes == 1 << 16
+    assert reports[-1].eta >= 0
+
+
+def test_benchmark():
+    challenge = os.urandom(40)
+    result = benchmark(challenge, 12)
+    assert result['bits'] == 12
+    assert result['hashes'] == int.from_bytes(_mint(challenge, 12),
+                                              sys.byteorder)
+    assert result['seconds'] >= 0
+
+
+@mark.parametrize('workers', [1, 2])
+def test_mint_cancel(workers):
+    calls = []
+
+    def cancel():
+        calls.append(None)
+        return len(calls) > 2
+
+    assert _mint(os.urandom(40), 64, workers=workers,
+                 cancel=cancel, interval=0) is None
+    assert len(calls) == 3
+    assert _mint(b'foo', 16, cancel=lambda: False) == b'-g'
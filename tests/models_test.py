@@ -1,20 +1,43 @@
 import datetime
+import functools
+import json
+import multiprocessing
+import time
 
 import pytest
+from pytest_localserver.http import WSGIServer
+import requests
 from secp256k1 import PrivateKey, PublicKey
+from sqlalchemy.orm import sessionmaker
 
-from nekoyume.exc import InvalidMoveError
-from nekoyume.models import (Block,
+from nekoyume.exc import InvalidBlockError, InvalidMoveError
+from nekoyume.models import (EVICTION_FAILURES,
+                             LIVE_FAILURES,
+                             Block,
+                             BlockWatcher,
                              CreateNovice,
                              HackAndSlash,
+                             HeaderWindow,
+                             LRUCache,
                              LevelUp,
                              Move,
                              Node,
                              Say,
                              Send,
+                             SerializationCache,
                              Sleep,
                              User,
-                             get_address)
+                             fetch_block_chunks,
+                             fetch_block_pages,
+                             get_address,
+                             get_broadcast_executor,
+                             http_session,
+                             cache,
+                             db,
+                             migrate,
+                             serializations,
+                             verified_moves,
+                             verify_moves)
 
 
 @pytest.fixture
@@ -24,13 +47,6 @@ def fx_user2(fx_session):
     return user
 
 
-@pytest.fixture
-def fx_other_user(fx_other_session):
-    user = User(PrivateKey())
-    user.session = fx_other_session
-    return user
-
-
 def test_move_confirmed_and_validation(fx_user, fx_novice_status):
     move = Move()
     assert not move.confirmed
@@ -52,6 +68,106 @@ def test_move_confirmed_and_validation(fx_user, fx_novice_status):
     assert not block.valid
 
 
+def test_move_verification_cache(fx_user, fx_novice_status):
+    move = fx_user.create_novice(fx_novice_status)
+    key = (move.id, move.signature, move.user_public_key)
+    assert verified_moves.get(key) is True
+    hits = verified_moves.hits
+    assert move.valid
+    assert verified_moves.hits == hits + 1
+
+    move.tax = 1
+    assert not move.valid
+    assert verified_moves.hits == hits + 1
+
+
+def test_serialization_memo(fx_user, fx_novice_status):
+    move = fx_user.create_novice(fx_novice_status)
+    block = fx_user.create_block([move])
+    serialized_block = block.serialize(True, True, True, True)
+    assert block.serialize(True, True, True, True) is serialized_block
+    serialized_move = move.serialize(include_signature=True)
+    assert move.serialize(include_signature=True) is serialized_move
+
+    move.tax = 1
+    assert move.serialize(include_signature=True) != serialized_move
+    assert block.serialize(True, True, True, True) != serialized_block
+    assert not block.valid
+
+    move.details['strength'] = '10'
+    assert b'8:strength2:10' in move.serialize()
+
+    serialized_block = block.serialize()
+    block.difficulty += 1
+    assert block.serialize() != serialized_block
+
+
+def test_serialization_cache(fx_app, monkeypatch):
+    loads = []
+
+    def load():
+        loads.append(None)
+        return {'loaded': len(loads)}
+
+    # Without the shared cache deletions by other workers couldn't be
+    # told, so nothing is cached.
+    worker = SerializationCache(maxsize=8)
+    assert worker.get('a', load) == {'loaded': 1}
+    assert worker.get('a', load) == {'loaded': 2}
+
+    # Workers share entries and invalidation through the shared cache.
+    cache.init_app(fx_app, config={'CACHE_TYPE': 'simple'})
+    other_worker = SerializationCache(maxsize=8)
+    assert worker.get('a', load) == {'loaded': 3}
+    assert worker.get('a', load) == {'loaded': 3}
+    assert other_worker.get('a', load) == {'loaded': 3}
+    assert worker.get('b', lambda: None) is None
+    assert worker.get('c', load, lambda value: False) == {'loaded': 4}
+    assert worker.get('c', load) == {'loaded': 5}
+    other_worker.invalidate()
+    assert worker.get('a', load) == {'loaded': 6}
+
+    # Once the shared cache fails, the other worker's invalidation can't
+    # reach this one, so its own entries aren't served either.
+    def fail(*args, **kwargs):
+        raise ConnectionError()
+
+    monkeypatch.setattr(cache, 'get', fail)
+    monkeypatch.setattr(cache, 'set', fail)
+    other_worker.invalidate()
+    assert worker.get('a', load) == {'loaded': 7}
+    assert worker.get('a', load) == {'loaded': 8}
+
+
+def test_serializations_invalidated_on_deletion(fx_user, fx_session):
+    block = fx_user.create_block([])
+    generation = serializations.local_generation
+    fx_session.delete(block)
+    fx_session.rollback()
+    assert serializations.local_generation == generation
+    fx_session.delete(block)
+    fx_session.commit()
+    assert serializations.local_generation == generation + 1
+    fx_session.query(Move).delete()
+    fx_session.commit()
+    assert serializations.local_generation == generation + 2
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache.get('a') == 1
+    cache['c'] = 3
+    assert len(cache) == 2
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert (cache.hits, cache.misses) == (3, 1)
+    cache.clear()
+    assert not len(cache)
+
+
 def test_level_up(fx_user, fx_novice_status):
     move = fx_user.create_novice(fx_novice_status)
     fx_user.create_block([move])
@@ -118,6 +234,82 @@ def test_send_validation(fx_user, fx_user2, fx_novice_status):
     assert fx_user2.avatar(block.id).items['GOLD'] == 0
 
 
+def test_move_details(fx_session, fx_user, fx_user2, fx_novice_status):
+    move = fx_user.create_novice(fx_novice_status)
+    move2 = fx_user2.create_novice(fx_novice_status)
+    fx_user.create_block([move, move2])
+    move = fx_user.send('GOLD', 1, fx_user2.address)
+    assert move.receiver == fx_user2.address
+    assert Sleep().details == {}
+    assert Sleep().receiver is None
+    block_id = fx_user.create_block([move]).id
+    move_id = move.id
+    fx_session.expunge_all()
+
+    move = fx_session.query(Move).get(move_id)
+    assert move.details == {
+        'item_name': 'GOLD',
+        'amount': '1',
+        'receiver': fx_user2.address,
+    }
+    assert move.id == move.hash
+    assert fx_session.query(Move).filter_by(
+        receiver=fx_user2.address
+    ).one() is move
+    move.details['receiver'] = fx_user.address
+    assert move.receiver == fx_user.address
+    fx_session.rollback()
+    assert fx_user2.avatar(block_id).items['GOLD'] == 1
+
+
+def test_migrate(fx_session, fx_user, fx_user2, fx_novice_status):
+    move = fx_user.create_novice(fx_novice_status)
+    move2 = fx_user2.create_novice(fx_novice_status)
+    fx_user.create_block([move, move2])
+    move = fx_user.send('GOLD', 1, fx_user2.address)
+    block_id = fx_user.create_block([move]).id
+    move_id = move.id
+    details = {m.id: dict(m.details) for m in fx_session.query(Move)}
+    fx_session.expunge_all()
+
+    # Make the database look like older versions that kept details of moves
+    # in the move_detail table.
+    fx_session.execute('DROP INDEX ix_move_receiver')
+    fx_session.execute('ALTER TABLE move DROP COLUMN receiver')
+    fx_session.execute('ALTER TABLE move DROP COLUMN details')
+    fx_session.execute('DROP INDEX ix_node_failures')
+    fx_session.execute('ALTER TABLE node DROP COLUMN failures')
+    fx_session.execute(
+        "INSERT INTO node (url, last_connected_at) "
+        "VALUES ('http://example.com', '2018-01-01 00:00:00')"
+    )
+    fx_session.execute(
+        'CREATE TABLE move_detail ('
+        'move_id VARCHAR NOT NULL, key VARCHAR NOT NULL, '
+        'value VARCHAR NOT NULL, PRIMARY KEY (move_id, key))'
+    )
+    for id_, move_details in details.items():
+        for key, value in move_details.items():
+            fx_session.execute(
+                'INSERT INTO move_detail VALUES (:move_id, :key, :value)',
+                {'move_id': id_, 'key': key, 'value': str(value)}
+            )
+    fx_session.commit()
+
+    migrate(fx_session)
+    assert not fx_session.get_bind().has_table('move_detail')
+    migrated = fx_session.query(Move).get(move_id)
+    assert migrated.details == {
+        k: str(v) for k, v in details[move_id].items()
+    }
+    assert migrated.receiver == fx_user2.address
+    assert migrated.valid
+    assert fx_user2.avatar(block_id).items['GOLD'] == 1
+    assert fx_session.query(Node).get('http://example.com').failures == 0
+    # Migrating an up-to-date database does nothing.
+    migrate(fx_session)
+
+
 def test_block_validation(fx_user, fx_novice_status):
     move = fx_user.create_novice(fx_novice_status)
     block = fx_user.create_block([move])
@@ -127,6 +319,82 @@ def test_block_validation(fx_user, fx_novice_status):
     assert not block.valid
 
 
+def test_create_block_cancel(fx_user, fx_session, fx_novice_status):
+    move = fx_user.create_novice(fx_novice_status)
+    assert fx_user.create_block([move], cancel=lambda: True) is None
+    assert fx_session.query(Block).count() == 0
+    assert not move.block
+
+    block = fx_user.create_block([move], cancel=lambda: False)
+    assert block.valid
+    assert fx_session.query(Block).count() == 1
+
+
+def test_header_window(fx_user, fx_session):
+    blocks = [fx_user.create_block([]) for _ in range(13)]
+    window = HeaderWindow.of(fx_session)
+    assert sorted(window.headers) == [b.id for b in blocks[-11:]]
+    assert window.tip.hash == blocks[-1].hash
+    assert blocks[-1].valid
+
+    fx_session.rollback()
+    assert not window.headers
+    assert window.get(blocks[5].id, fx_session).hash == blocks[5].hash
+    assert window.tip.id == blocks[5].id
+    assert not window.get(blocks[-1].id + 1, fx_session)
+    assert window.get(blocks[-1].id, fx_session).hash == blocks[-1].hash
+
+    for block in blocks[-3:]:
+        fx_session.delete(block)
+    fx_session.flush()
+    assert window.tip.hash == blocks[-4].hash
+
+    fork = fx_user.create_block([])
+    assert fork.id == blocks[-3].id
+    assert window.tip.hash == fork.hash
+    assert window.get(blocks[-4].id, fx_session).hash == blocks[-4].hash
+
+
+def test_header_window_refresh(fx_user, fx_session):
+    blocks = [fx_user.create_block([]) for _ in range(3)]
+    session = sessionmaker(bind=db.engine)()
+    try:
+        window = HeaderWindow.of(session)
+        assert window.get(blocks[-1].id, session).hash == blocks[-1].hash
+
+        # Another session reorganizes the chain meanwhile.
+        fx_session.delete(blocks[-1])
+        fx_session.commit()
+        fork = fx_user.create_block([])
+        next_block = fx_user.create_block([])
+        serialized = next_block.serialize(use_bencode=False,
+                                          include_suffix=True,
+                                          include_moves=True,
+                                          include_hash=True)
+        fx_session.delete(next_block)
+        fx_session.commit()
+
+        added = Block.add_serialized_blocks([serialized], session)
+        assert [b.hash for b in added] == [next_block.hash]
+        assert window.get(fork.id, session).hash == fork.hash
+    finally:
+        session.close()
+
+
+def test_add_serialized_blocks_in_other_session(fx_user, fx_other_session):
+    blocks = [fx_user.create_block([]) for _ in range(3)]
+    serialized = [b.serialize(use_bencode=False, include_suffix=True,
+                              include_moves=True, include_hash=True)
+                  for b in blocks]
+    # The default session has the first block, but the other one doesn't.
+    with pytest.raises(InvalidBlockError):
+        Block.add_serialized_blocks(serialized[1:], fx_other_session)
+    added = Block.add_serialized_blocks(serialized, fx_other_session)
+    assert [b.hash for b in added] == [b.hash for b in blocks]
+    window = HeaderWindow.of(fx_other_session)
+    assert window.tip.hash == blocks[-1].hash
+
+
 def test_avatar_modifier(fx_user, fx_novice_status):
     move = fx_user.create_novice(fx_novice_status)
     fx_user.create_block([move])
@@ -206,6 +474,141 @@ def test_move_broadcast(fx_user, fx_session, fx_other_user, fx_other_session,
     assert fx_session.query(Move).get(move.id)
 
 
+@pytest.mark.parametrize('knows_inventory', [True, False])
+def test_announce(fx_session, fx_other_user, fx_other_session, fx_server,
+                  fx_novice_status, fx_relayed, monkeypatch, knows_inventory):
+    if not knows_inventory:
+        monkeypatch.setattr(Node, 'post_inventory_endpoint', '/unknown')
+    fx_other_session.add(Node(url=fx_server.url,
+                              last_connected_at=datetime.datetime.utcnow()))
+    fx_other_session.commit()
+
+    move = fx_other_user.create_novice(fx_novice_status)
+    results = Node.announce(moves=[move], session=fx_other_session)
+    assert [r.ok for r in results] == [True]
+    assert fx_session.query(Move).get(move.id)
+    assert fx_relayed == [move.id]
+
+    # Only nodes which don't know inventories get it again.
+    Node.announce(moves=[move], session=fx_other_session)
+    if knows_inventory:
+        assert fx_relayed == [move.id]
+
+
+def test_broadcast_results(fx_session, fx_other_user, fx_other_session,
+                           fx_server, fx_novice_status, fx_relayed):
+    long_ago = datetime.datetime(2018, 1, 1)
+    dead_url = 'http://127.0.0.1:1'
+    fx_other_session.add(Node(url=fx_server.url, last_connected_at=long_ago))
+    fx_other_session.add(Node(url=dead_url, last_connected_at=long_ago))
+    fx_other_session.commit()
+
+    move = fx_other_user.create_novice(fx_novice_status)
+    results = sorted(move.broadcast(session=fx_other_session))
+    assert [(r.url, r.ok, r.error) for r in results] == [
+        (dead_url, False, 'ConnectionError'),
+        (fx_server.url, True, None),
+    ]
+    assert all(r.latency < 3 for r in results)
+    assert fx_session.query(Move).get(move.id)
+    dead = fx_other_session.query(Node).get(dead_url)
+    assert dead.last_connected_at == long_ago
+    assert dead.failures == 1
+    assert dead.next_check_at > dead.last_checked_at
+    live = fx_other_session.query(Node).get(fx_server.url)
+    assert live.last_connected_at > long_ago
+    assert live.failures == 0
+
+
+def test_http_session():
+    # Threads share connections, lest each keep its own to every node.
+    executor = get_broadcast_executor()
+    sessions = list(executor.map(lambda _: http_session(), range(64)))
+    assert all(session is sessions[0] for session in sessions)
+
+
+def test_check_health(fx_server, fx_session):
+    dead_url = 'http://127.0.0.1:1'
+    now = datetime.datetime(2018, 1, 1)
+    for url in (dead_url, fx_server.url):
+        fx_session.add(Node(url=url, last_connected_at=now))
+    fx_session.commit()
+
+    results = Node.check_health(fx_session, now)
+    assert sorted((r.url, r.ok) for r in results) == [
+        (dead_url, False), (fx_server.url, True)
+    ]
+    live = fx_session.query(Node).get(fx_server.url)
+    assert live.failures == 0
+    assert live.rtt is not None
+    assert live.next_check_at == now + datetime.timedelta(minutes=1)
+    dead = fx_session.query(Node).get(dead_url)
+    assert dead.failures == 1
+    assert dead.next_check_at == now + datetime.timedelta(minutes=2)
+    assert [n.url for n in Node.live(fx_session)] == [
+        fx_server.url, dead_url
+    ]
+    # Nodes aren't checked until they are due.
+    assert Node.check_health(fx_session, now) == []
+
+    for failures in range(2, 10):
+        Node.check_health(fx_session, dead.next_check_at)
+        assert dead.failures == failures
+    assert [n.url for n in Node.live(fx_session)] == [fx_server.url]
+    Node.check_health(fx_session, dead.next_check_at)
+    # Dead nodes aren't deleted, lest broadcasts recording them fail.
+    assert dead.failures == EVICTION_FAILURES
+    assert dead.next_check_at is None
+    later = now + datetime.timedelta(days=365)
+    assert [r.url for r in Node.check_health(fx_session, later)] == [
+        fx_server.url
+    ]
+
+
+def test_probe_nodes(fx_user, fx_server, fx_session):
+    block = fx_user.create_block([])
+    dead_url = 'http://127.0.0.1:1'
+    now = datetime.datetime.utcnow()
+    for url in (dead_url, fx_server.url):
+        fx_session.add(Node(url=url, last_connected_at=now))
+    fx_session.commit()
+    live = fx_session.query(Node).get(fx_server.url)
+    dead = fx_session.query(Node).get(dead_url)
+
+    assert Node.probe([live, dead]) == {
+        fx_server.url: block.serialize(use_bencode=False,
+                                       include_suffix=True,
+                                       include_moves=True,
+                                       include_hash=True)
+    }
+    assert (live.height, live.error_rate) == (block.id, 0)
+    assert live.rtt is not None
+    assert dead.height is None
+    assert dead.error_rate > 0
+
+    fast = Node(url='http://fast', rtt=0.1, throughput=1 << 22)
+    slow = Node(url='http://slow', rtt=0.1, throughput=1 << 16)
+    flaky = Node(url='http://flaky', rtt=0.1, throughput=1 << 22,
+                 error_rate=0.9)
+    assert fast.cost < slow.cost
+    assert fast.cost < flaky.cost
+    fast.record(True, 1, 1 << 20)
+    assert fast.throughput < 1 << 22
+
+
+def test_update_nodes_all_failing(fx_server, fx_session, monkeypatch):
+    # The node knows only itself, under another URL.
+    other_url = fx_server.url.replace('127.0.0.1', 'localhost')
+    monkeypatch.setenv('PUBLIC_URL', other_url)
+    fx_session.add(Node(url=fx_server.url, failures=LIVE_FAILURES,
+                        last_connected_at=datetime.datetime.utcnow()))
+    fx_session.commit()
+    assert not Node.live(fx_session).all()
+
+    Node.update()
+    assert [n.url for n in Node.live(fx_session)] == [other_url]
+
+
 def test_node(fx_server, fx_session):
     assert fx_server.url
     assert Node.get(fx_server.url, session=fx_session)
@@ -244,6 +647,344 @@ def test_sync(fx_user, fx_session, fx_other_user, fx_other_session, fx_server,
     assert fx_session.query(Move).count() == 1
 
 
+@pytest.mark.parametrize('corrupt', ['ids', 'hash'])
+def test_sync_records_bad_page(fx_app, fx_user, fx_other_session, request,
+                               corrupt):
+    for _ in range(3):
+        fx_user.create_block([])
+
+    def serve(environ, start_response):
+        # Pages of blocks are corrupted; the rest is served as it is.
+        if environ['PATH_INFO'] != Node.get_blocks_endpoint or \
+           not environ['QUERY_STRING']:
+            return fx_app.wsgi_app(environ, start_response)
+        response = fx_app.test_client().get(
+            f"{Node.get_blocks_endpoint}?{environ['QUERY_STRING']}"
+        )
+        blocks = json.loads(response.get_data(as_text=True))['blocks']
+        for block in blocks:
+            if corrupt == 'ids':
+                block['id'] += 1
+            else:
+                block['hash'] = '0' * 64
+        body = json.dumps({'blocks': blocks}).encode()
+        start_response('200 OK', [('Content-Type', 'application/json'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+
+    server = WSGIServer(application=serve)
+    server.start()
+    request.addfinalizer(server.stop)
+    node = Node(url=server.url, last_connected_at=datetime.datetime.utcnow())
+    fx_other_session.add(node)
+    fx_other_session.commit()
+
+    with pytest.raises(InvalidBlockError):
+        Block.sync(node, fx_other_session)
+    assert fx_other_session.query(Block).count() == 0
+    node = fx_other_session.query(Node).get(server.url)
+    assert node.height == 3
+    assert node.error_rate > 0
+
+
+def test_verify_headers(fx_user, fx_other_session):
+    blocks = [fx_user.create_block([]) for _ in range(3)]
+    headers = [b.serialize(use_bencode=False, include_suffix=True,
+                           include_hash=True) for b in blocks]
+    assert Block.verify_headers(headers, fx_other_session) == {
+        b.id: b.hash for b in blocks
+    }
+    with pytest.raises(InvalidBlockError):
+        Block.verify_headers(headers[1:], fx_other_session)
+    with pytest.raises(InvalidBlockError):
+        Block.verify_headers([headers[0], headers[2]], fx_other_session)
+    with pytest.raises(InvalidBlockError):
+        Block.verify_headers(
+            [headers[0], dict(headers[1], suffix='00'), headers[2]],
+            fx_other_session
+        )
+
+
+def test_verify_headers_in_linear_time(fx_user, fx_other_session,
+                                       monkeypatch):
+    header = fx_user.create_block([]).serialize(
+        use_bencode=False, include_suffix=True, include_hash=True
+    )
+    headers = [dict(header, id=i) for i in range(1, 5001)]
+    monkeypatch.setattr(Block, 'valid_proof', lambda *args, **kwargs: True)
+    sizes = []
+
+    def max_(*args, **kwargs):
+        if len(args) == 1:
+            args = (list(args[0]),)
+            sizes.append(len(args[0]))
+        return max(*args, **kwargs)
+
+    monkeypatch.setattr('nekoyume.models.max', max_, raising=False)
+    assert len(Block.verify_headers(headers, fx_other_session)) == 5000
+    # Nothing is looked over all the headers verified so far.
+    assert all(size <= HeaderWindow.size for size in sizes)
+
+
+def test_sync_rejects_invalid_headers(fx_user, fx_session, fx_other_session,
+                                      fx_server, fx_novice_status):
+    fx_user.create_block([fx_user.create_novice(fx_novice_status)])
+    fx_user.create_block([])
+    fx_session.query(Block).filter_by(id=2).update({'suffix': b'\x00'})
+    fx_session.commit()
+
+    with pytest.raises(InvalidBlockError):
+        Block.sync(Node(url=fx_server.url), fx_other_session)
+    assert fx_other_session.query(Block).count() == 0
+    assert fx_other_session.query(Move).count() == 0
+
+
+def test_locate_branch_point(fx_user, fx_session, fx_other_user,
+                             fx_other_session, fx_server):
+    node = Node(url=fx_server.url)
+    for _ in range(3):
+        fx_user.create_block([])
+    Block.sync(node, fx_other_session)
+    assert Block.locate_branch_point(node, 3, fx_other_session) == 3
+
+    fx_user.create_block([])
+    fx_user.create_block([])
+    fx_other_user.create_block([])
+    assert Block.locate_branch_point(node, 4, fx_other_session) == 3
+    assert Block.locate_branch_point(node, 4, fx_other_session,
+                                     limit=1) == 3
+
+    Block.sync(node, fx_other_session)
+    assert fx_other_session.query(Block).get(5).hash == \
+        fx_session.query(Block).get(5).hash
+
+
+def test_sync_from_legacy_node(fx_user, fx_session, fx_other_session,
+                               fx_legacy_server):
+    node = Node(url=fx_legacy_server.url)
+    for _ in range(3):
+        fx_user.create_block([])
+    assert Block.fetch_headers(node, 1, 3) is None
+    Block.sync(node, fx_other_session)
+    assert fx_other_session.query(Block).count() == 3
+
+    fx_user.create_block([])
+    fx_user.create_block([])
+    assert Block.locate_branch_point(node, 3, fx_other_session) is None
+    Block.sync(node, fx_other_session)
+    assert fx_other_session.query(Block).get(5).hash == \
+        fx_session.query(Block).get(5).hash
+
+
+@pytest.mark.parametrize('pool_moves', [1, 256])
+def test_sync_with_workers(fx_user, fx_session, fx_other_session,
+                           fx_server, fx_novice_status, monkeypatch,
+                           pool_moves):
+    monkeypatch.setattr('nekoyume.models.POOL_MOVES', pool_moves)
+    move = fx_user.create_novice(fx_novice_status)
+    fx_user.create_block([move])
+    fx_user.create_block([fx_user.sleep()])
+
+    Block.sync(Node(url=fx_server.url), fx_other_session, workers=2)
+    assert fx_other_session.query(Block).count() == 2
+    assert fx_other_session.query(Move).count() == 2
+
+
+def test_fetch_block_pages(fx_user, fx_server):
+    for _ in range(5):
+        fx_user.create_block([])
+    url = f'{fx_server.url}{Node.get_blocks_endpoint}'
+
+    def ids(pages):
+        return [[b['id'] for b in page] for page in pages]
+
+    # Fast responses grow pages, and slow ones shrink them.
+    assert ids(fetch_block_pages(url, 1, 5, limit=2, latency=60)) == [
+        [1, 2], [3, 4, 5]
+    ]
+    assert ids(fetch_block_pages(url, 1, 5, limit=2, latency=0)) == [
+        [1, 2], [3], [4], [5]
+    ]
+    assert ids(fetch_block_pages(url, 2, 100, limit=3, latency=60)) == [
+        [2, 3, 4], [5]
+    ]
+    assert ids(fetch_block_pages(url, 6, 10)) == []
+
+    pages = fetch_block_pages(url, 1, 5, limit=1, depth=1)
+    assert ids([next(pages)]) == [[1]]
+    pages.close()
+
+
+def test_fetch_block_pages_timeout(request):
+    def stall(environ, start_response):
+        time.sleep(1)
+        start_response('200 OK', [('Content-Type', 'application/json')])
+        return [b'{"blocks": []}']
+
+    server = WSGIServer(application=stall)
+    server.start()
+    request.addfinalizer(server.stop)
+    pages = fetch_block_pages(f'{server.url}{Node.get_blocks_endpoint}',
+                              1, 5, timeout=0.1)
+    with pytest.raises(requests.exceptions.Timeout):
+        next(pages)
+
+
+def test_fetch_block_chunks(fx_user, fx_server):
+    blocks = [fx_user.create_block([]) for _ in range(5)]
+    hashes = {b.id: b.hash for b in blocks}
+    dead_url = 'http://localhost:1'
+
+    def ids(chunks):
+        return [[b['id'] for b in chunk] for chunk in chunks]
+
+    # Chunks which failed on a node are downloaded from another one.
+    heights = {dead_url: 5, fx_server.url: 5}
+    assert ids(fetch_block_chunks(heights, 1, 5, chunk_size=2)) == [
+        [1, 2], [3, 4], [5]
+    ]
+    assert ids(fetch_block_chunks(
+        heights, 2, 5, chunk_size=3,
+        check=lambda c: all(hashes[b['id']] == b['hash'] for b in c)
+    )) == [[2, 3, 4], [5]]
+
+    # Nodes aren't asked for blocks higher than theirs.
+    with pytest.raises(InvalidBlockError):
+        list(fetch_block_chunks({fx_server.url: 3}, 1, 5, chunk_size=2))
+    with pytest.raises(InvalidBlockError):
+        list(fetch_block_chunks(heights, 1, 5, check=lambda c: False))
+
+
+def test_sync_from_nodes(fx_user, fx_session, fx_other_session, fx_server,
+                         fx_novice_status):
+    fx_user.create_block([fx_user.create_novice(fx_novice_status)])
+    fx_user.create_block([])
+    # Two URLs of the same node.
+    for url in (fx_server.url, fx_server.url.replace('127.0.0.1',
+                                                     'localhost')):
+        fx_session.add(Node(url=url,
+                            last_connected_at=datetime.datetime.utcnow()))
+    fx_session.commit()
+
+    Block.sync(session=fx_other_session)
+    assert fx_other_session.query(Block).count() == 2
+    assert fx_other_session.query(Move).count() == 1
+
+
+@pytest.mark.parametrize('tamper', ['drop', 'alter', 'creator'])
+def test_sync_from_nodes_retries_tampered_blocks(fx_app, fx_user, fx_session,
+                                                 fx_other_session, fx_server,
+                                                 request, monkeypatch,
+                                                 tamper):
+    monkeypatch.setattr('nekoyume.models.fetch_block_chunks',
+                        functools.partial(fetch_block_chunks, chunk_size=1))
+    for _ in range(4):
+        fx_user.create_block([fx_user.sleep()])
+    tampered = []
+
+    def serve(environ, start_response):
+        # Blocks are served with the right hashes, but without moves, with
+        # moves which don't match their ids, or with a tampered header.
+        if environ['PATH_INFO'] != Node.get_blocks_endpoint or \
+           not environ['QUERY_STRING']:
+            return fx_app.wsgi_app(environ, start_response)
+        response = fx_app.test_client().get(
+            f"{Node.get_blocks_endpoint}?{environ['QUERY_STRING']}"
+        )
+        blocks = json.loads(response.get_data(as_text=True))['blocks']
+        for block in blocks:
+            if tamper == 'drop':
+                block['moves'] = []
+            elif tamper == 'alter':
+                for move in block['moves']:
+                    move['tax'] += 1
+            else:
+                block['creator'] = '0' * 40
+            tampered.append(block['id'])
+        body = json.dumps({'blocks': blocks}).encode()
+        start_response('200 OK', [('Content-Type', 'application/json'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+
+    server = WSGIServer(application=serve)
+    server.start()
+    request.addfinalizer(server.stop)
+    for url in (fx_server.url, server.url):
+        fx_session.add(Node(url=url,
+                            last_connected_at=datetime.datetime.utcnow()))
+    fx_session.commit()
+
+    assert Block.sync(session=fx_other_session)
+    assert tampered
+    assert fx_other_session.query(Block).count() == 4
+    assert fx_other_session.query(Move).count() == 4
+
+
+@pytest.mark.parametrize('server', ['fx_server', 'fx_legacy_server'])
+def test_wait_for_block(fx_user, request, server):
+    server = request.getfixturevalue(server)
+    node = Node(url=server.url)
+    block = fx_user.create_block([])
+    assert node.wait_for_block(0, None, timeout=1)
+    assert not node.wait_for_block(block.id, block.hash, timeout=0.5)
+
+    watcher = BlockWatcher(timeout=10)
+    arrived = watcher.watch([server.url], block.id, block.hash)
+    assert not arrived.wait(0.2)
+    started_at = time.monotonic()
+    fx_user.create_block([])
+    assert arrived.wait(5)
+    assert time.monotonic() - started_at < 5
+
+
+def test_block_watcher(fx_user, fx_server, monkeypatch):
+    urls = [fx_server.url, fx_server.url.replace('127.0.0.1', 'localhost')]
+    block = fx_user.create_block([])
+    watcher = BlockWatcher(timeout=2)
+    arrived = watcher.watch(urls, 0, None)
+    assert arrived.wait(5)
+    thread = watcher.thread
+
+    # The same thread watches the next block.
+    arrived = watcher.watch(urls, block.id, block.hash)
+    assert not arrived.wait(0.5)
+    fx_user.create_block([])
+    assert arrived.wait(5)
+    assert watcher.thread is thread
+
+    # A node which fails unexpectedly doesn't stop watching the others.
+    wait_for_block = Node.wait_for_block
+
+    def fail_on_first(node, *args, **kwargs):
+        if node.url == urls[0]:
+            raise ValueError()
+        return wait_for_block(node, *args, **kwargs)
+
+    monkeypatch.setattr(Node, 'wait_for_block', fail_on_first)
+    block = fx_user.create_block([])
+    arrived = watcher.watch(urls, block.id, block.hash)
+    fx_user.create_block([])
+    assert arrived.wait(5)
+    assert watcher.thread.is_alive()
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_verify_moves(fx_user, fx_novice_status, workers):
+    moves = [fx_user.create_novice(fx_novice_status), fx_user.sleep()]
+    serialized = [m.serialize(False, True, True) for m in moves]
+    serialized.append(dict(serialized[1], tax=1))
+    serialized.append(dict(serialized[0], signature='00'))
+    pool = workers and multiprocessing.Pool(workers)
+    try:
+        assert verify_moves(serialized, pool) == {moves[0].id: False,
+                                                  moves[1].id: False}
+        assert verify_moves(serialized[:2], pool) == {moves[0].id: True,
+                                                      moves[1].id: True}
+    finally:
+        if pool:
+            pool.terminate()
+
+
 def test_flush_session_while_syncing(fx_user, fx_session, fx_other_session, fx_novice_status):
     # 1. block validation failure scenario
     # syncing without flushing can cause block validation failure
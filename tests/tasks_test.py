@@ -1,13 +1,30 @@
-import pytest
+from nekoyume.models import Node
+from nekoyume.tasks import RelayQueue
 
-from nekoyume.tasks import block_broadcast
 
+def test_relay_queue(fx_user, fx_session, fx_novice_status, monkeypatch):
+    announced = []
+    monkeypatch.setattr(Node, 'announce',
+                        lambda **kwargs: announced.append(kwargs))
+    moves = [fx_user.create_novice(fx_novice_status), fx_user.sleep()]
+    blocks = [fx_user.create_block([]) for _ in range(3)]
 
-def test_muted_attribute_error(fx_session):
-    try:
-        block_broadcast(0,
-                        'http://localhost:5000',
-                        'http://localhsot:5001',
-                        session=fx_session)
-    except AttributeError:
-        pytest.fail('broadcast tasks should not raise AttributeError.')
+    queue = RelayQueue(linger=0)
+    # The worker can't take any relay until all of them are queued.
+    with queue.condition:
+        for move in moves + moves:
+            queue.relay_move(move.id, my_node_url='http://localhost:5000')
+        queue.relay_block(blocks[2].id, my_node_url='http://localhost:5000')
+        queue.relay_block(blocks[0].id, my_node_url='http://localhost:5000')
+        queue.relay_block(blocks[0].id, my_node_url='http://localhost:5000')
+    assert queue.join(timeout=5)
+
+    assert [
+        (sorted(m.id for m in a['moves']), [b.id for b in a['blocks']])
+        for a in announced
+    ] == [
+        (sorted(m.id for m in moves), [blocks[0].id]),
+        ([], [blocks[2].id]),
+    ]
+    assert all(a['my_node'].url == 'http://localhost:5000' and
+               a['sent_node'].url is None for a in announced)